@@ -0,0 +1,42 @@
+# Import-time benchmark: wall time of a fresh interpreter running each statement, minus a bare interpreter start.
+# Run from the repository root:  python benchmarks/bench_import.py
+# For a per-module breakdown:    PYTHONPATH=src python -X importtime -c "import homie_helpers"
+import os
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+REPEAT = 10
+
+STATEMENTS = [
+    "import homie_helpers",
+    "from homie_helpers import create_homie_id",
+    "from homie_helpers import MqttClient",
+    "from homie_helpers import IntProperty, FloatProperty",
+    "from homie_helpers import *",
+]
+
+
+def run(statement):
+    env = dict(os.environ, PYTHONPATH=SRC)
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], env=env, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def modules(statement):
+    env = dict(os.environ, PYTHONPATH=SRC)
+    output = subprocess.run([sys.executable, '-c', statement + "\nimport sys; print(len(sys.modules))"],
+                            env=env, check=True, capture_output=True, text=True).stdout
+    return int(output.split()[-1])
+
+
+if __name__ == '__main__':
+    baseline = run("pass")
+    print("%-52s %8.1f ms" % ("python -c pass", baseline * 1e3))
+    for statement in STATEMENTS:
+        print("%-52s %8.1f ms   (%s modules)" % (statement, (run(statement) - baseline) * 1e3, modules(statement)))
@@ -0,0 +1,60 @@
+# Micro-benchmark of a single property value assignment, without any MQTT traffic.
+# Run from the repository root:  python benchmarks/bench_property_setters.py
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from homie.node.node_base import Node_Base
+
+from homie_helpers import IntProperty, FloatProperty, BooleanProperty, StringProperty, EnumProperty
+
+NUMBER = 200_000
+
+
+class NullDevice:
+    name = 'bench'
+    topic = 'bench/device'
+    state = 'init'
+
+    def publish(self, topic, payload, retain, qos):
+        pass
+
+    def publish_value(self, topic, payload, retain, qos):
+        pass
+
+
+def setup(property):
+    node = Node_Base(NullDevice(), 'node', 'Node', 'node')
+    node.published = True
+    property.setup_homie4_property(node)
+    return property
+
+
+def bench(label, property, value):
+    property = setup(property)
+    raw = property.raw_property()
+
+    def assign():
+        property.value = value
+
+    def assign_raw():
+        raw.value = value
+
+    ns = min(timeit.repeat(assign, number=NUMBER, repeat=3)) / NUMBER * 1e9
+    raw_ns = min(timeit.repeat(assign_raw, number=NUMBER, repeat=3)) / NUMBER * 1e9
+    print("%-32s %8.0f ns   (homie4 setter: %8.0f ns)" % (label, ns, raw_ns))
+
+
+if __name__ == '__main__':
+    logging.disable(logging.WARNING)
+    bench("IntProperty", IntProperty("prop"), 5)
+    bench("IntProperty(min, max)", IntProperty("prop", min_value=0, max_value=100), 50)
+    bench("IntProperty(min, max, clamp)", IntProperty("prop", min_value=0, max_value=100, clamp=True), 150)
+    bench("FloatProperty", FloatProperty("prop"), 21.5)
+    bench("FloatProperty(precision=2)", FloatProperty("prop", precision=2), 21.5123)
+    bench("BooleanProperty", BooleanProperty("prop"), True)
+    bench("StringProperty", StringProperty("prop"), "value")
+    bench("EnumProperty", EnumProperty("prop", values=[str(i) for i in range(32)]), "31")
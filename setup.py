@@ -27,4 +27,5 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     install_requires=["paho-mqtt>=1.3.0", "Homie4>=0.3.8"],
+    extras_require={"numpy": ["numpy"]},
 )
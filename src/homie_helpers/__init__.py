@@ -1,5 +1,31 @@
-from .device import *
-from .properties import *
+import importlib
+
+# public names are imported on first use, so that e.g. `from homie_helpers import create_homie_id`
+# does not load paho and Homie4, and `MqttClient` does not load the typed properties
+_MODULES = {
+    'Property': 'device',
+    'Node': 'device',
+    'Homie': 'device',
+    'create_homie_id': 'names',
+    'IntProperty': 'properties',
+    'FloatProperty': 'properties',
+    'StringProperty': 'properties',
+    'BooleanProperty': 'properties',
+    'EnumProperty': 'properties',
+    'ArrayProperty': 'properties',
+    'array_decoder': 'properties',
+    'State': 'device',
+    'MetaAccessor': 'device',
+    'MqttSettings': 'device',
+    'MqttClient': 'device',
+    'MqttListener': 'device',
+    'ConnectionPool': 'connections',
+    'PublishFuture': 'connections',
+    'LocalBroker': 'local_broker',
+    'Supervisor': 'supervisor',
+    'PropertyGroup': 'groups',
+    'PollingScheduler': 'scheduler',
+}
 
 __all__ = [
     'Property',
@@ -11,9 +37,29 @@ __all__ = [
     'StringProperty',
     'BooleanProperty',
     'EnumProperty',
+    'ArrayProperty',
+    'array_decoder',
     'State',
     'MetaAccessor',
     'MqttSettings',
     'MqttClient',
-    'MqttListener'
+    'MqttListener',
+    'ConnectionPool',
+    'PublishFuture',
+    'LocalBroker',
+    'Supervisor',
+    'PropertyGroup',
+    'PollingScheduler'
 ]
+
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module('.' + _MODULES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,362 @@
+import asyncio
+import logging
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from paho.mqtt.reasoncodes import ReasonCodes
+
+import homie.mqtt.homie_mqtt_client as homie4_mqtt_client
+from homie.mqtt.mqtt_base import MQTT_Base
+from homie.mqtt.paho_mqtt_client import PAHO_MQTT_Client
+
+
+class PublishFuture:
+    # also usable in place of paho's MQTTMessageInfo: rc and mid are those of the underlying publish() -
+    # available once the message is handed over to paho, which MqttClient.publish does before returning
+    def __init__(self):
+        self.submitted_at = time.monotonic()
+        self.completed_at = None
+        self.rc = mqtt.MQTT_ERR_SUCCESS
+        self.mid = None
+        self._published = False
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self) -> bool:
+        return self._event.is_set()
+
+    def succeeded(self) -> bool:
+        return self.done() and self._published
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._event.wait(timeout)
+
+    @property
+    def latency(self) -> float:
+        return None if self.completed_at is None else self.completed_at - self.submitted_at
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def complete(self, rc: int = mqtt.MQTT_ERR_SUCCESS):
+        with self._lock:
+            if self._event.is_set():
+                return
+            if rc == mqtt.MQTT_ERR_SUCCESS:
+                self._published = True
+            else:
+                self.rc = rc
+            self.completed_at = time.monotonic()
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    # paho's MQTTMessageInfo interface
+    def __iter__(self):
+        return iter((self.rc, self.mid))
+
+    def __getitem__(self, index):
+        return (self.rc, self.mid)[index]
+
+    def _check_queued(self):
+        if self.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+            raise ValueError('Message is not queued due to ERR_QUEUE_SIZE')
+        if self.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_AGAIN):
+            raise RuntimeError('Message publish failed: %s' % mqtt.error_string(self.rc))
+
+    def is_published(self) -> bool:
+        self._check_queued()
+        return self.succeeded()
+
+    def wait_for_publish(self, timeout: float = None) -> bool:
+        self._check_queued()
+        return self.wait(timeout)
+
+
+def reason_code(rc) -> int:
+    # with MQTT 5, paho passes ReasonCodes instead of ints, which Homie4 compares with ints
+    return rc.value if isinstance(rc, ReasonCodes) else rc
+
+
+class PooledMqttClient(PAHO_MQTT_Client):
+    def __init__(self, settings, last_will: str = None):
+        mqtt_settings = homie4_mqtt_client.MQTT_SETTINGS.copy()
+        mqtt_settings.update(settings.to_homie4_mqtt_settings())
+        super().__init__(mqtt_settings, last_will)
+        self.logger = logging.getLogger('PooledMqttClient')
+        self.brokers = settings.brokers()
+        self.broker_index = 0
+        self.mqtt5 = settings.mqtt5
+        self.topic_aliases = {}
+        self.topic_alias_maximum = 0
+        self.message_listeners = ()
+        self.listener_topics = []
+        self._lock = threading.Lock()
+        # mids of SUBSCRIBE packets not acknowledged by the broker yet
+        self._subscribing = set()
+        self._in_flight = {}
+        self._acknowledged = set()
+        # number of _send calls registering their message right now
+        self._publishing = 0
+        self._in_flight_lock = threading.Lock()
+
+    @property
+    def broker(self):
+        return self.brokers[self.broker_index]
+
+    def connect(self):
+        MQTT_Base.connect(self)
+        self.mqtt_client = mqtt.Client(client_id=self.mqtt_settings["MQTT_CLIENT_ID"],
+                                       protocol=mqtt.MQTTv5 if self.mqtt5 else mqtt.MQTTv311)
+        self.mqtt_client.on_connect = self._on_connect
+        self.mqtt_client.on_message = self._on_message
+        self.mqtt_client.on_disconnect = self._on_disconnect
+        self.mqtt_client.on_publish = self._on_publish
+        self.mqtt_client.on_subscribe = self._on_subscribe
+        if self.last_will is not None:
+            self.set_will(self.last_will, "lost", True, 1)
+        if self.mqtt_settings["MQTT_USERNAME"]:
+            self.mqtt_client.username_pw_set(self.mqtt_settings["MQTT_USERNAME"],
+                                             password=self.mqtt_settings["MQTT_PASSWORD"])
+        if self.mqtt_settings["MQTT_USE_TLS"]:
+            self.mqtt_client.tls_set()
+        self._connect_to_available_broker()
+        self.mqtt_client.loop_start()
+
+        self.event_loop = asyncio.new_event_loop()
+        self._ws_thread = threading.Thread(target=self.event_loop.run_forever, daemon=True)
+        self._ws_thread.start()
+
+    def _connect_to_available_broker(self):
+        for attempt in range(len(self.brokers)):
+            host, port = self.broker
+            try:
+                self.mqtt_client.connect(host, port=port, keepalive=self.mqtt_settings["MQTT_KEEPALIVE"])
+                return
+            except OSError as e:
+                self.logger.warning("Unable to connect to mqtt://%s:%s: %s" % (host, port, e))
+                self.broker_index = (self.broker_index + 1) % len(self.brokers)
+        # none of the brokers is available right now - let the paho network thread keep retrying
+        host, port = self.broker
+        self.mqtt_client.connect_async(host, port=port, keepalive=self.mqtt_settings["MQTT_KEEPALIVE"])
+
+    def publish(self, topic, payload, retain, qos, expiry: int = None, alias: bool = False) -> PublishFuture:
+        future = PublishFuture()
+        self.event_loop.call_soon_threadsafe(self._send, future, topic, payload, retain, qos, expiry, alias)
+        return future
+
+    def publish_batch(self, messages: list, expiry: int = None) -> list:
+        # messages are (topic, payload, retain, qos) tuples; they are handed over to the
+        # publish thread in a single call instead of one call per message
+        if len(messages) == 0:
+            return []
+        futures = [PublishFuture() for _ in messages]
+
+        def publish_all():
+            for future, (topic, payload, retain, qos) in zip(futures, messages):
+                self._send(future, topic, payload, retain, qos, expiry, True)
+        self.event_loop.call_soon_threadsafe(publish_all)
+        return futures
+
+    def submit(self, topic, payload, retain, qos) -> PublishFuture:
+        # publishes from the calling thread, so that rc and mid of the future are set on return, as with paho
+        future = PublishFuture()
+        self._send(future, topic, payload, retain, qos)
+        return future
+
+    def _send(self, future: PublishFuture, topic, payload, retain, qos, expiry: int = None, alias: bool = False):
+        with self._in_flight_lock:
+            self._publishing += 1
+        try:
+            if not self.mqtt5:
+                info = self.mqtt_client.publish(topic, payload, qos=qos, retain=retain)
+            else:
+                properties = Properties(PacketTypes.PUBLISH)
+                if expiry is not None:
+                    properties.MessageExpiryInterval = expiry
+                if alias:
+                    topic = self._alias_topic(topic, qos, properties)
+                info = self.mqtt_client.publish(topic, payload, qos=qos, retain=retain, properties=properties)
+        except (ValueError, TypeError) as e:
+            self.logger.warning("Unable to publish to %s: %s" % (topic, e))
+            info = None
+        # QoS 0 messages are dropped by paho when there is no connection
+        dropped = info is not None and info.rc != mqtt.MQTT_ERR_SUCCESS and qos == 0
+        if info is not None:
+            future.rc, future.mid = info.rc, info.mid
+        with self._in_flight_lock:
+            # paho may report the message as published before publish() returns here
+            acknowledged = info is not None and info.mid in self._acknowledged
+            if acknowledged:
+                self._acknowledged.discard(info.mid)
+            self._publishing -= 1
+            if self._publishing == 0:
+                self._acknowledged.clear()
+            if info is not None and not dropped and not acknowledged:
+                self._in_flight[info.mid] = future
+        if info is None:
+            future.complete(mqtt.MQTT_ERR_INVAL)
+        elif dropped:
+            future.complete(info.rc)
+        elif acknowledged:
+            future.complete()
+
+    def _on_publish(self, client, userdata, mid):
+        # called when a QoS 0 message is written to the socket, or a QoS 1/2 message is acknowledged
+        with self._in_flight_lock:
+            future = self._in_flight.pop(mid, None)
+            # an unknown mid is kept only while _send is registering its message - it may be that one; anything
+            # else (e.g. published through the raw paho client) must not linger until the 16-bit mids wrap around
+            if future is None and self._publishing > 0:
+                self._acknowledged.add(mid)
+        if future is not None:
+            future.complete()
+
+    def _alias_topic(self, topic, qos, properties: Properties) -> str:
+        # only property values are aliased, so that one-off announcements do not use up the broker's limit
+        aliases = self.topic_aliases
+        alias = aliases.get(topic)
+        if alias is not None:
+            properties.TopicAlias = alias
+            # paho re-sends QoS>0 messages as they were after a reconnect, when the broker no longer
+            # knows the alias - so only QoS 0 messages may leave the topic out
+            return '' if qos == 0 else topic
+        if len(aliases) < self.topic_alias_maximum:
+            aliases[topic] = len(aliases) + 1
+            properties.TopicAlias = aliases[topic]
+        return topic
+
+    def add_listener(self, topic: str, listener):
+        with self._lock:
+            self.message_listeners = self.message_listeners + (listener,)
+            if topic not in self.listener_topics:
+                self.listener_topics.append(topic)
+                self._subscribe(topic)
+
+    def _subscribe(self, topic: str):
+        # called with the lock held
+        rc, mid = self.mqtt_client.subscribe(topic)
+        if rc == mqtt.MQTT_ERR_SUCCESS:
+            self._subscribing.add(mid)
+
+    def _on_subscribe(self, client, userdata, mid, granted_qos, properties=None):
+        with self._lock:
+            self._subscribing.discard(mid)
+
+    def subscribed(self) -> bool:
+        # connected, and every listener subscription acknowledged by the broker
+        with self._lock:
+            return self.mqtt_connected and len(self._subscribing) == 0
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        rc = reason_code(rc)
+        host, port = self.broker
+        self.logger.info("Connected to mqtt://%s:%s with result code %s" % (host, port, rc))
+        # topic aliases live only as long as the network connection
+        self.topic_aliases = {}
+        self.topic_alias_maximum = getattr(properties, 'TopicAliasMaximum', 0)
+        with self._lock:
+            self._subscribing.clear()
+            if rc == 0:
+                for topic in self.listener_topics:
+                    self._subscribe(topic)
+        super()._on_connect(client, userdata, flags, rc)
+
+    def _on_message(self, client, userdata, msg):
+        # runs on the paho network thread shared by every device on this connection, so nothing may escape from here
+        topic = msg.topic
+        try:
+            payload = msg.payload.decode('utf-8')
+        except UnicodeDecodeError:
+            self.logger.warning("Ignoring message on %s which is not UTF-8" % topic)
+            return
+        for device in self.homie_devices:
+            if device.start_time is not None:
+                try:
+                    device.mqtt_on_message(topic, payload, msg.retain == 1, msg.qos)
+                except Exception:
+                    self.logger.exception("Device on_message error")
+        for listener in self.message_listeners:
+            try:
+                listener(topic, payload)
+            except Exception:
+                self.logger.exception("Listener on_message error")
+
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        rc = reason_code(rc)
+        super()._on_disconnect(client, userdata, rc)
+        if rc != 0 and len(self.brokers) > 1:
+            self.broker_index = (self.broker_index + 1) % len(self.brokers)
+            host, port = self.broker
+            self.logger.warning("Failing over to mqtt://%s:%s" % (host, port))
+            client.connect_async(host, port=port, keepalive=self.mqtt_settings["MQTT_KEEPALIVE"])
+
+    def close(self, timeout: float = 1.0):
+        MQTT_Base.close(self)
+        closed = threading.Event()
+
+        def disconnect():
+            # runs after everything already queued on the publish thread
+            self.mqtt_client.disconnect()
+            self.event_loop.stop()
+            closed.set()
+        self.event_loop.call_soon_threadsafe(disconnect)
+        closed.wait(timeout)
+        self.mqtt_client.loop_stop()
+
+
+class ConnectionPool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def acquire(self, settings, shard_key: str = None, last_will: str = None,
+                share_group: str = None) -> PooledMqttClient:
+        shard = 0 if shard_key is None or settings.shards <= 1 else zlib.crc32(shard_key.encode()) % settings.shards
+        # device connections (with a last will) are shared only between devices: a listener created first
+        # would otherwise leave the devices without a will, and its callbacks would run on their network thread
+        key = settings.connection_key() + (shard, share_group, last_will is not None)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = PooledMqttClient(settings, last_will)
+                client.connect()
+                self._clients[key] = client
+            return client
+
+    def __len__(self):
+        return len(self._clients)
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+CONNECTION_POOL = ConnectionPool()
+
+_homie4_lock = threading.Lock()
+
+
+@contextmanager
+def homie4_shared_client(client: PooledMqttClient):
+    # Homie4 has a single, process-wide "common" client; it is pointed at the pooled
+    # client only for the time a device is being constructed
+    with _homie4_lock:
+        homie4_mqtt_client.common_mqtt_client = client
+        try:
+            yield
+        finally:
+            homie4_mqtt_client.common_mqtt_client = None
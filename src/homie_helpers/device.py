@@ -1,56 +1,44 @@
 import logging
-import re
+import threading
 import time
 from enum import Enum, auto
 
-import paho.mqtt.client as mqtt
-
 import homie.device_base
 from homie.device_base import Device_Base
 from homie.node.node_base import Node_Base
 from homie.node.property.property_base import Property_Base
 
+from .connections import ConnectionPool, CONNECTION_POOL, PublishFuture, homie4_shared_client
+from .groups import PropertyGroup
+from .names import create_homie_id, homie_name, to_homie4_meta
+from .scheduler import PollingScheduler, POLLING_SCHEDULER
 
-def homie_name(id: str, name: str):
-    return id.capitalize().replace('-', " ") if name is None else name
-
-
-def to_homie4_meta(meta: dict) -> dict:
-    result = {}
-    for key in meta:
-        value = meta[key]
-        result[create_homie_id(key)] = {
-            'name': key,
-            'value': value
-        }
-    return result
 
-
-def create_homie_id(group_name: str) -> str:
-    normalized = group_name \
-        .lower() \
-        .replace('ł', 'l') \
-        .replace('ę', 'e') \
-        .replace('ó', 'o') \
-        .replace('ą', 'a') \
-        .replace('ś', 's') \
-        .replace('ł', 'l') \
-        .replace('ż', 'z') \
-        .replace('ź', 'z') \
-        .replace('ć', 'c') \
-        .replace('ń', 'n')
-    return re.sub(r'[^a-z0-9]', '-', normalized).lstrip('-')
+def pass_through(value):
+    return value
 
 
 class Property:
-    def __init__(self, id: str, meta: dict, initial_value):
+    def __init__(self, id: str, meta: dict, initial_value, poll=None, interval: float = None, qos: int = 1):
+        if poll is not None and (interval is None or interval <= 0):
+            raise ValueError("Property %s is polled, but has no positive interval" % id)
+        if qos not in (0, 1, 2):
+            raise ValueError("Unsupported QoS of property %s: %s" % (id, qos))
         self.id = id
         self._meta_as_key_value_dict = meta
         self._homie4_property = None
         self._initial_value = initial_value
+        self.poll = poll
+        self.interval = interval
+        self.qos = qos
+        # validator and serializer are selected once by the typed subclasses, so that
+        # the publish path below does not need to dispatch on the property type
+        self._validate = pass_through
+        self._serialize = pass_through
 
     def setup_homie4_property(self, node: Node_Base):
         self._homie4_property = self.create_homie_property(node)
+        self._homie4_property.get_payload_from_value = self._serialize
         node.add_property(self._homie4_property)
 
     def create_homie_property(self, node):
@@ -63,7 +51,33 @@ class Property:
 
     @value.setter
     def value(self, value):
-        self._homie4_property.value = value
+        self.set(value)
+
+    def set(self, value):
+        # returns a PublishFuture, or None if the value was rejected or the device is not published yet
+        try:
+            payload = self._accept(value)
+        except (TypeError, ValueError) as e:
+            logging.getLogger('Property').warning("Invalid value of property %s: %s" % (self.id, e))
+            return None
+        return self._publish(payload)
+
+    def _publish(self, payload):
+        homie4_property = self._homie4_property
+        node = homie4_property.node
+        if node.published:
+            return node.device.publish_value(homie4_property.topic, payload, True, self.qos)
+        return None
+
+    def _accept(self, value):
+        # validates and stores the value; returns the payload to be published
+        payload = None
+        if value is not None:
+            value = self._validate(value)
+            payload = self._serialize(value)
+        # stored only once it is known to be publishable
+        self._homie4_property._value = value
+        return payload
 
     @property
     def meta(self):
@@ -89,13 +103,28 @@ class Node:
 
 class MqttSettings:
     def __init__(self, broker: str, port: int = 1883, username: str = None, password: str = None, topic: str = "homie",
-                 connect_timeout_ms: int = 1000):
+                 connect_timeout_ms: int = 1000, failover: list = None, shards: int = 1, mqtt5: bool = False,
+                 value_expiry_s: int = None):
         self.broker = broker
         self.port = port
         self.username = username
         self.password = password
         self.topic = topic
         self.connect_timeout = connect_timeout_ms
+        self.failover = failover if failover is not None else []
+        self.shards = shards
+        self.mqtt5 = mqtt5
+        self.value_expiry = value_expiry_s
+
+    def brokers(self) -> list:
+        result = [(self.broker, self.port)]
+        for address in self.failover:
+            host, _, port = address.partition(':')
+            result.append((host, int(port) if port else self.port))
+        return result
+
+    def connection_key(self) -> tuple:
+        return self.broker, self.port, self.username, self.password, self.topic, self.mqtt5
 
     def to_homie4_mqtt_settings(self):
         return {
@@ -117,7 +146,11 @@ class MqttSettings:
             broker=settings.get('broker'),
             port=settings.get('port', 1883),
             username=settings.get('username', None),
-            password=settings.get('password', None)
+            password=settings.get('password', None),
+            failover=settings.get('failover', None),
+            shards=settings.get('shards', 1),
+            mqtt5=settings.get('mqtt5', False),
+            value_expiry_s=settings.get('value_expiry_s', None)
         )
 
     def __repr__(self):
@@ -142,42 +175,56 @@ class MqttListener:
         return self.val
 
 class MqttClient:
-    def __init__(self, mqtt_settings: MqttSettings):
+    def __init__(self, mqtt_settings: MqttSettings, pool: ConnectionPool = None, share_group: str = None):
         self.logger = logging.getLogger('MqttClient')
-        self.client = mqtt.Client()
-        self.client.username_pw_set(mqtt_settings.username, mqtt_settings.password)
-        self.client.connect(mqtt_settings.broker, mqtt_settings.port)
         self.mqtt_collectors: list[MqttListener] = []
-        def on_connect(client, userdata, flags, rc):
-            self.logger.info("Connected with result code %s" % str(rc))
-            client.subscribe(f"{mqtt_settings.topic}/#")
-        def on_message(client, userdata, msg):
-            topic = msg.topic
-            payload = msg.payload.decode(encoding='UTF-8')
-            for collector in self.mqtt_collectors:
-                collector.collect(topic, payload)
-        self.client.on_connect = on_connect
-        self.client.on_message = on_message
-        self.client.loop_start()
-
-    def publish(self, topic, payload):
-        return self.client.publish(topic, payload)
+        pool = CONNECTION_POOL if pool is None else pool
+        self.connection = pool.acquire(mqtt_settings, share_group=share_group)
+        self.client = self.connection.mqtt_client
+        topic = f"{mqtt_settings.topic}/#" if share_group is None else f"$share/{share_group}/{mqtt_settings.topic}/#"
+        self.connection.add_listener(topic, self.dispatch)
+
+    def dispatch(self, topic, payload):
+        for collector in self.mqtt_collectors:
+            collector.collect(topic, payload)
+
+    def publish(self, topic, payload, qos: int = 0, retain: bool = False) -> PublishFuture:
+        return self.connection.submit(topic, payload, retain, qos)
 
     def listen(self, topic, processor=str):
         collector = MqttListener(topic, self.logger, processor)
         self.mqtt_collectors.append(collector)
         return collector
 
+    def record(self, path: str):
+        from .traffic import TrafficRecorder
+        recorder = TrafficRecorder(path)
+        self.mqtt_collectors.append(recorder)
+        return recorder
+
+    def stop_recording(self, recorder):
+        # the list is replaced rather than modified, as dispatch may be iterating over it on the network thread
+        self.mqtt_collectors = [collector for collector in self.mqtt_collectors if collector is not recorder]
+        recorder.close()
+
 
 class DeviceBaseWrapper(Device_Base):
     def __init__(self, settings: MqttSettings,
                  id: str,
                  name: str = None,
-                 nodes: list = []):
-        super().__init__(device_id=id,
-                         name=homie_name(id, name),
-                         mqtt_settings=settings.to_homie4_mqtt_settings(),
-                         homie_settings=settings.to_homie4_homie_settings())
+                 nodes: list = [],
+                 pool: ConnectionPool = None):
+        pool = CONNECTION_POOL if pool is None else pool
+        mqtt_client = pool.acquire(settings, shard_key=id, last_will=f"{settings.topic}/{id}/$state")
+        self.value_expiry = settings.value_expiry
+        self.published_messages = 0
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        with homie4_shared_client(mqtt_client):
+            super().__init__(device_id=id,
+                             name=homie_name(id, name),
+                             mqtt_settings=settings.to_homie4_mqtt_settings(),
+                             homie_settings=settings.to_homie4_homie_settings())
         start_time_ms = int(round(time.time() * 1000))
         while not self.mqtt_client.mqtt_connected and int(
                 round(time.time() * 1000)) - start_time_ms < settings.connect_timeout:
@@ -199,6 +246,40 @@ class DeviceBaseWrapper(Device_Base):
     def get_property_by_id(self, property_id) -> Property:
         return self.__registered_properties_by_id[property_id]
 
+    def get_properties(self) -> list:
+        return list(self.__registered_properties_by_id.values())
+
+    def publish(self, topic, payload, retain, qos):
+        self.published_messages += 1
+        return self._track(self.mqtt_client.publish(topic, payload, retain, qos))
+
+    def publish_value(self, topic, payload, retain, qos):
+        self.published_messages += 1
+        return self._track(self.mqtt_client.publish(topic, payload, retain, qos, expiry=self.value_expiry, alias=True))
+
+    def publish_batch(self, messages: list):
+        self.published_messages += len(messages)
+        return [self._track(future) for future in self.mqtt_client.publish_batch(messages, expiry=self.value_expiry)]
+
+    def _track(self, future: PublishFuture) -> PublishFuture:
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._untrack)
+        return future
+
+    def _untrack(self, future: PublishFuture):
+        with self._pending_lock:
+            self._pending.discard(future)
+
+    def flush(self, timeout: float = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._pending_lock:
+            pending = list(self._pending)
+        for future in pending:
+            if not future.wait(None if deadline is None else max(deadline - time.monotonic(), 0)):
+                return False
+        return True
+
 
 class MetaAccessor:
     def __init__(self, device: Device_Base):
@@ -256,9 +337,28 @@ class Homie:
     def __init__(self, settings: MqttSettings,
                  id: str,
                  name: str = None,
-                 nodes: list = []):
-        self._device = DeviceBaseWrapper(settings, id, name, nodes)
+                 nodes: list = [],
+                 pool: ConnectionPool = None,
+                 scheduler: PollingScheduler = None):
+        self._device = DeviceBaseWrapper(settings, id, name, nodes, pool)
         self.meta = MetaAccessor(self._device)
+        polled = [property for property in self._device.get_properties() if property.poll is not None]
+        self.scheduler = None
+        if len(polled) > 0:
+            self.scheduler = POLLING_SCHEDULER if scheduler is None else scheduler
+            self.scheduler.add(self._device, polled)
+
+    def stop_polling(self):
+        if self.scheduler is not None:
+            self.scheduler.remove(self._device)
+
+    @property
+    def id(self) -> str:
+        return self._device.device_id
+
+    @property
+    def published_messages(self) -> int:
+        return self._device.published_messages
 
     def __getitem__(self, property_id):
         return self._device.get_property_by_id(property_id).value
@@ -266,6 +366,16 @@ class Homie:
     def __setitem__(self, property_id, value):
         self._device.get_property_by_id(property_id).value = value
 
+    def set(self, property_id, value) -> PublishFuture:
+        return self._device.get_property_by_id(property_id).set(value)
+
+    def flush(self, timeout: float = None) -> bool:
+        return self._device.flush(timeout)
+
+    def group(self, property_ids: list, deadband: float = 0.0, precision: int = None):
+        properties = [self._device.get_property_by_id(property_id) for property_id in property_ids]
+        return PropertyGroup(self._device, properties, deadband=deadband, precision=precision)
+
     @property
     def state(self):
         return State.from_homie4_string(self._device.state)
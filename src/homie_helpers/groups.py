@@ -0,0 +1,69 @@
+import logging
+import math
+
+
+def load_numpy():
+    # numpy takes longer to import than the rest of the package, so it is loaded by the first group instead
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class PropertyGroup:
+    def __init__(self, device, properties: list, deadband: float = 0.0, precision: int = None):
+        self.logger = logging.getLogger('PropertyGroup')
+        self._device = device
+        self.properties = properties
+        self.deadband = deadband
+        self.precision = precision
+        self._numpy = load_numpy()
+        if self._numpy is not None:
+            self._last = self._numpy.full(len(properties), self._numpy.nan)
+            self._changes = self._vectorized_changes
+        else:
+            self._last = [None] * len(properties)
+            self._changes = self._sequential_changes
+
+    def __len__(self):
+        return len(self.properties)
+
+    def update(self, values) -> int:
+        if len(values) != len(self.properties):
+            raise ValueError("Expected %s values, got %s" % (len(self.properties), len(values)))
+        values, changed = self._changes(values)
+        messages = []
+        for index in changed:
+            property = self.properties[index]
+            value = values[index]
+            try:
+                payload = property._accept(value)
+            except (TypeError, ValueError) as e:
+                self.logger.warning("Invalid value of property %s: %s" % (property.id, e))
+                continue
+            self._last[index] = value
+            homie4_property = property.raw_property()
+            if homie4_property.node.published:
+                messages.append((homie4_property.topic, payload, True, property.qos))
+        self._device.publish_batch(messages)
+        return len(messages)
+
+    def _vectorized_changes(self, values):
+        numpy = self._numpy
+        values = numpy.asarray(values, dtype=float)
+        if self.precision is not None:
+            values = numpy.round(values, self.precision)
+        # NaN (never published) never satisfies the comparison, so it always counts as a change;
+        # missing (None) and non-finite readings are skipped and the last published value is kept
+        unchanged = numpy.abs(values - self._last) <= self.deadband
+        return values.tolist(), numpy.flatnonzero(numpy.isfinite(values) & ~unchanged).tolist()
+
+    def _sequential_changes(self, values):
+        finite = [value is not None and math.isfinite(value) for value in values]
+        if self.precision is not None:
+            values = [round(value, self.precision) if ok else value for value, ok in zip(values, finite)]
+        changed = [index for index, (value, last, ok) in enumerate(zip(values, self._last, finite))
+                   if ok and (last is None or not abs(value - last) <= self.deadband)]
+        return values, changed
+
@@ -0,0 +1,334 @@
+import logging
+import socket
+import struct
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+PROPERTY_MESSAGE_EXPIRY = 0x02
+PROPERTY_TOPIC_ALIAS_MAXIMUM = 0x22
+PROPERTY_TOPIC_ALIAS = 0x23
+
+# sizes of MQTT 5 property values, by property type (see "2.2.2.2 Property" of the MQTT 5 specification)
+BYTE_PROPERTIES = {0x01, 0x17, 0x19, 0x24, 0x25, 0x28, 0x29, 0x2A}
+TWO_BYTE_PROPERTIES = {0x13, 0x21, 0x22, 0x23}
+FOUR_BYTE_PROPERTIES = {0x02, 0x11, 0x18, 0x27}
+STRING_PAIR_PROPERTIES = {0x26}
+VARIABLE_INT_PROPERTIES = {0x0B}
+
+
+def encode_variable_int(value: int) -> bytes:
+    result = bytearray()
+    while True:
+        byte = value % 128
+        value //= 128
+        result.append(byte | 0x80 if value > 0 else byte)
+        if value == 0:
+            return bytes(result)
+
+
+def encode_string(value: str) -> bytes:
+    data = value.encode('utf-8')
+    return struct.pack('!H', len(data)) + data
+
+
+def packet(type: int, flags: int, body: bytes) -> bytes:
+    return bytes([type << 4 | flags]) + encode_variable_int(len(body)) + body
+
+
+class Reader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.position = 0
+
+    def remaining(self) -> int:
+        return len(self.data) - self.position
+
+    def bytes(self, count: int) -> bytes:
+        result = self.data[self.position:self.position + count]
+        self.position += count
+        return result
+
+    def byte(self) -> int:
+        return self.bytes(1)[0]
+
+    def short(self) -> int:
+        return struct.unpack('!H', self.bytes(2))[0]
+
+    def variable_int(self) -> int:
+        result, multiplier = 0, 1
+        while True:
+            byte = self.byte()
+            result += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if byte & 0x80 == 0:
+                return result
+
+    def string(self) -> str:
+        return self.bytes(self.short()).decode('utf-8')
+
+    def properties(self) -> dict:
+        result = {}
+        end = self.variable_int() + self.position
+        while self.position < end:
+            id = self.variable_int()
+            if id in BYTE_PROPERTIES:
+                result[id] = self.byte()
+            elif id in TWO_BYTE_PROPERTIES:
+                result[id] = self.short()
+            elif id in FOUR_BYTE_PROPERTIES:
+                result[id] = struct.unpack('!I', self.bytes(4))[0]
+            elif id in VARIABLE_INT_PROPERTIES:
+                result[id] = self.variable_int()
+            elif id in STRING_PAIR_PROPERTIES:
+                result[id] = (self.string(), self.string())
+            else:
+                result[id] = self.bytes(self.short())
+        return result
+
+
+class Session:
+    def __init__(self, broker, connection: socket.socket):
+        self.broker = broker
+        self.connection = connection
+        self.client_id = None
+        self.protocol = 4
+        self.subscriptions = {}
+        self.topic_aliases = {}
+        self.will = None
+        self._write_lock = threading.Lock()
+
+    def send(self, data: bytes):
+        with self._write_lock:
+            try:
+                self.connection.sendall(data)
+            except OSError:
+                pass
+
+    def deliver(self, topic: str, payload: bytes, retain: bool):
+        # everything is delivered with QoS 0
+        body = encode_string(topic)
+        if self.protocol == 5:
+            body += b'\x00'
+        self.send(packet(PUBLISH, 1 if retain else 0, body + payload))
+
+    def disconnect(self, reason_code: int):
+        # server-side DISCONNECT, which only MQTT 5 has; older clients just lose the connection
+        if self.protocol == 5:
+            # with a reason string (0x1F), as paho 1.6 reads the reason code only from longer packets
+            properties = b'\x1f' + encode_string('disconnected by broker')
+            self.send(packet(DISCONNECT, 0, bytes([reason_code]) + encode_variable_int(len(properties)) + properties))
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def run(self):
+        clean = False
+        try:
+            while True:
+                header = self._read(1)
+                if header is None:
+                    break
+                length, multiplier = 0, 1
+                while True:
+                    byte = self._read(1)[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if byte & 0x80 == 0:
+                        break
+                body = self._read(length) if length > 0 else b''
+                type, flags = header[0] >> 4, header[0] & 0x0F
+                if type == DISCONNECT:
+                    clean = True
+                    break
+                self._handle(type, flags, Reader(body))
+        except (OSError, ValueError, IndexError, KeyError, struct.error) as e:
+            self.broker.logger.debug("Session %s closed: %s" % (self.client_id, e))
+        finally:
+            self.connection.close()
+            self.broker.remove(self, publish_will=not clean)
+
+    def _read(self, count: int):
+        data = b''
+        while len(data) < count:
+            chunk = self.connection.recv(count - len(data))
+            if not chunk:
+                if data == b'' and count == 1:
+                    return None
+                raise OSError("connection closed")
+            data += chunk
+        return data
+
+    def _handle(self, type: int, flags: int, reader: Reader):
+        if type == CONNECT:
+            self._handle_connect(reader)
+        elif type == PUBLISH:
+            self._handle_publish(flags, reader)
+        elif type == PUBREL:
+            self.send(packet(PUBCOMP, 0, reader.bytes(2)))
+        elif type == SUBSCRIBE:
+            self._handle_subscribe(reader)
+        elif type == UNSUBSCRIBE:
+            self._handle_unsubscribe(reader)
+        elif type == PINGREQ:
+            self.send(packet(PINGRESP, 0, b''))
+
+    def _handle_connect(self, reader: Reader):
+        reader.string()  # protocol name
+        self.protocol = reader.byte()
+        flags = reader.byte()
+        reader.short()  # keep alive
+        if self.protocol == 5:
+            reader.properties()
+        self.client_id = reader.string()
+        if flags & 0x04:
+            if self.protocol == 5:
+                reader.properties()
+            self.will = (reader.string(), reader.bytes(reader.short()), bool(flags & 0x20))
+        if self.protocol == 5:
+            properties = b''
+            if self.broker.topic_alias_maximum > 0:
+                properties = bytes([PROPERTY_TOPIC_ALIAS_MAXIMUM]) + struct.pack('!H', self.broker.topic_alias_maximum)
+            self.send(packet(CONNACK, 0, b'\x00\x00' + encode_variable_int(len(properties)) + properties))
+        else:
+            self.send(packet(CONNACK, 0, b'\x00\x00'))
+
+    def _handle_publish(self, flags: int, reader: Reader):
+        qos = (flags >> 1) & 0x03
+        retain = bool(flags & 0x01)
+        topic = reader.string()
+        packet_id = reader.short() if qos > 0 else None
+        properties = reader.properties() if self.protocol == 5 else {}
+        alias = properties.get(PROPERTY_TOPIC_ALIAS)
+        if alias is not None:
+            if topic:
+                self.topic_aliases[alias] = topic
+            else:
+                topic = self.topic_aliases[alias]
+        self.broker.received_bytes += len(reader.data)
+        self.broker.publish(topic, reader.bytes(reader.remaining()), retain, properties, qos)
+        if qos == 1:
+            self.send(packet(PUBACK, 0, struct.pack('!H', packet_id)))
+        elif qos == 2:
+            self.send(packet(PUBREC, 0, struct.pack('!H', packet_id)))
+
+    def _handle_subscribe(self, reader: Reader):
+        packet_id = reader.short()
+        if self.protocol == 5:
+            reader.properties()
+        filters = []
+        while reader.remaining() > 0:
+            filters.append(reader.string())
+            reader.byte()  # options
+        properties = b'\x00' if self.protocol == 5 else b''
+        self.send(packet(SUBACK, 0, struct.pack('!H', packet_id) + properties + b'\x00' * len(filters)))
+        for topic_filter in filters:
+            self.broker.subscribe(self, topic_filter)
+
+    def _handle_unsubscribe(self, reader: Reader):
+        packet_id = reader.short()
+        if self.protocol == 5:
+            reader.properties()
+        filters = []
+        while reader.remaining() > 0:
+            filters.append(reader.string())
+        with self.broker._lock:
+            for topic_filter in filters:
+                self.subscriptions.pop(topic_filter, None)
+        codes = b'\x00' + b'\x00' * len(filters) if self.protocol == 5 else b''
+        self.send(packet(UNSUBACK, 0, struct.pack('!H', packet_id) + codes))
+
+
+class LocalBroker:
+    def __init__(self, port: int = 0, topic_alias_maximum: int = 16):
+        self.logger = logging.getLogger('LocalBroker')
+        self.topic_alias_maximum = topic_alias_maximum
+        self.sessions = []
+        self.retained = {}
+        self.received = []
+        self.received_bytes = 0
+        self._share_counters = {}
+        self._lock = threading.RLock()
+        self._server = socket.create_server(('127.0.0.1', port))
+        self.port = self._server.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = Session(self, connection)
+            with self._lock:
+                self.sessions.append(session)
+            threading.Thread(target=session.run, daemon=True).start()
+
+    def subscribe(self, session: Session, topic_filter: str):
+        with self._lock:
+            session.subscriptions[topic_filter] = True
+            if topic_filter.startswith('$share/'):
+                return
+            now = time.monotonic()
+            retained = [(topic, payload) for topic, (payload, expires_at) in self.retained.items()
+                        if mqtt.topic_matches_sub(topic_filter, topic) and (expires_at is None or expires_at > now)]
+        for topic, payload in retained:
+            session.deliver(topic, payload, True)
+
+    def publish(self, topic: str, payload: bytes, retain: bool, properties: dict = {}, qos: int = 0):
+        expiry = properties.get(PROPERTY_MESSAGE_EXPIRY)
+        with self._lock:
+            self.received.append((topic, payload, qos, properties))
+            if retain:
+                if len(payload) == 0:
+                    self.retained.pop(topic, None)
+                else:
+                    self.retained[topic] = (payload, None if expiry is None else time.monotonic() + expiry)
+            receivers = []
+            shared = {}
+            for session in self.sessions:
+                for topic_filter in session.subscriptions:
+                    if topic_filter.startswith('$share/'):
+                        _, group, group_filter = topic_filter.split('/', 2)
+                        if mqtt.topic_matches_sub(group_filter, topic):
+                            shared.setdefault((group, group_filter), []).append(session)
+                    elif mqtt.topic_matches_sub(topic_filter, topic) and session not in receivers:
+                        receivers.append(session)
+            for key, members in shared.items():
+                counter = self._share_counters.get(key, 0)
+                self._share_counters[key] = counter + 1
+                receivers.append(members[counter % len(members)])
+        for session in receivers:
+            session.deliver(topic, payload, False)
+
+    def remove(self, session: Session, publish_will: bool):
+        with self._lock:
+            if session in self.sessions:
+                self.sessions.remove(session)
+        if publish_will and session.will is not None:
+            topic, payload, retain = session.will
+            self.publish(topic, payload, retain)
+
+    def disconnect(self, reason_code: int = 0x8B):
+        # 0x8B: server shutting down
+        with self._lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            session.disconnect(reason_code)
+
+    def close(self):
+        self._server.close()
+        with self._lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            try:
+                session.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
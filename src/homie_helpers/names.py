@@ -0,0 +1,32 @@
+import re
+
+
+def homie_name(id: str, name: str):
+    return id.capitalize().replace('-', " ") if name is None else name
+
+
+def to_homie4_meta(meta: dict) -> dict:
+    result = {}
+    for key in meta:
+        value = meta[key]
+        result[create_homie_id(key)] = {
+            'name': key,
+            'value': value
+        }
+    return result
+
+
+def create_homie_id(group_name: str) -> str:
+    normalized = group_name \
+        .lower() \
+        .replace('ł', 'l') \
+        .replace('ę', 'e') \
+        .replace('ó', 'o') \
+        .replace('ą', 'a') \
+        .replace('ś', 's') \
+        .replace('ł', 'l') \
+        .replace('ż', 'z') \
+        .replace('ź', 'z') \
+        .replace('ć', 'c') \
+        .replace('ń', 'n')
+    return re.sub(r'[^a-z0-9]', '-', normalized).lstrip('-')
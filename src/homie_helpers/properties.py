@@ -1,10 +1,128 @@
-from homie.node.property.property_boolean import Property_Boolean
-from homie.node.property.property_enum import Property_Enum
-from homie.node.property.property_float import Property_Float
-from homie.node.property.property_integer import Property_Integer
-from homie.node.property.property_string import Property_String
+import base64
+import json
+import math
+import struct
+import zlib
 
-from .device import Property, homie_name, to_homie4_meta
+from .device import Property
+from .names import homie_name, to_homie4_meta
+
+# Homie4's typed property classes are imported by create_homie_property, i.e. only once a device is created
+
+
+def integer(value) -> int:
+    # unlike int(), does not truncate: 9.99 is rejected rather than published as 9
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError("%s is not an integer" % value)
+    return int(value)
+
+
+def range_validator(cast, min_value, max_value, clamp: bool):
+    if min_value is None and max_value is None:
+        return cast
+    low = -math.inf if min_value is None else cast(min_value)
+    high = math.inf if max_value is None else cast(max_value)
+    # comparisons are written so that NaN, which fails all of them, is rejected rather than let through
+    if clamp:
+        def validate(value):
+            value = cast(value)
+            if low <= value <= high:
+                return value
+            if value < low:
+                return low
+            if value > high:
+                return high
+            raise ValueError("%s is out of range %s:%s" % (value, min_value, max_value))
+    else:
+        def validate(value):
+            value = cast(value)
+            if not low <= value <= high:
+                raise ValueError("%s is out of range %s:%s" % (value, min_value, max_value))
+            return value
+    return validate
+
+
+def enum_validator(values: list):
+    allowed = frozenset(values)
+
+    def validate(value):
+        if value not in allowed:
+            raise ValueError("%s is not one of %s" % (value, ",".join(values)))
+        return value
+    return validate
+
+
+def float_serializer(precision: int = None):
+    return str if precision is None else ("%%.%df" % precision).__mod__
+
+
+def boolean_validator(value) -> bool:
+    # like Homie4, accepts only booleans - and their payloads, so that e.g. 'false' does not become True
+    if isinstance(value, bool):
+        return value
+    if value == 'true' or value == 'false':
+        return value == 'true'
+    raise ValueError("%r is not a boolean" % (value,))
+
+
+def boolean_serializer(value) -> str:
+    return 'true' if value else 'false'
+
+
+ARRAY_ENCODINGS = ['json', 'packed', 'zlib']
+ARRAY_DTYPES = {
+    'int16': ('h', int),
+    'int32': ('i', int),
+    'float32': ('f', float),
+    'float64': ('d', float),
+}
+
+
+def array_format(encoding: str, dtype: str) -> str:
+    if encoding not in ARRAY_ENCODINGS:
+        raise ValueError("Unsupported array encoding: %s" % encoding)
+    if dtype not in ARRAY_DTYPES:
+        raise ValueError("Unsupported array dtype: %s" % dtype)
+    return encoding if encoding == 'json' else "%s:%s" % (encoding, dtype)
+
+
+def array_encoder(encoding: str = 'json', dtype: str = 'float64'):
+    # binary encodings are sent as base64 text, so that payloads stay valid Homie strings
+    array_format(encoding, dtype)
+    code, _ = ARRAY_DTYPES[dtype]
+
+    def pack(values) -> bytes:
+        try:
+            return struct.pack('<%d%s' % (len(values), code), *values)
+        except struct.error as e:
+            # e.g. a value out of range of the dtype; reported like any other invalid value
+            raise ValueError("Unable to pack %s array: %s" % (dtype, e))
+
+    if encoding == 'json':
+        return lambda values: json.dumps(values, separators=(',', ':'))
+    if encoding == 'packed':
+        return lambda values: base64.b64encode(pack(values)).decode('ascii')
+    return lambda values: base64.b64encode(zlib.compress(pack(values))).decode('ascii')
+
+
+def array_decoder(encoding: str = 'json', dtype: str = 'float64'):
+    array_format(encoding, dtype)
+    code, cast = ARRAY_DTYPES[dtype]
+    size = struct.calcsize(code)
+
+    def unpack(data: bytes) -> list:
+        return list(struct.unpack('<%d%s' % (len(data) // size, code), data))
+
+    if encoding == 'json':
+        return lambda payload: [cast(value) for value in json.loads(payload)]
+    if encoding == 'packed':
+        return lambda payload: unpack(base64.b64decode(payload))
+    return lambda payload: unpack(zlib.decompress(base64.b64decode(payload)))
+
+
+def array_validator(dtype: str):
+    _, cast = ARRAY_DTYPES[dtype]
+    return lambda values: [cast(value) for value in values]
 
 
 class IntProperty(Property):
@@ -17,16 +135,24 @@ class IntProperty(Property):
                  meta: dict = {},
                  min_value: int = None,
                  max_value: int = None,
-                 initial_value = None):
-        super().__init__(id, meta, initial_value)
+                 initial_value = None,
+                 clamp: bool = False,
+                 poll=None,
+                 interval: float = None,
+                 qos: int = 1):
+        super().__init__(id, meta, initial_value, poll, interval, qos)
         self.name = homie_name(id, name)
         self.set_handler = set_handler
         self.unit = unit
         self.retained = retained
         self.min_value = min_value
         self.max_value = max_value
+        self.clamp = clamp
+        self._validate = range_validator(integer, min_value, max_value, clamp)
+        self._serialize = str
 
     def create_homie_property(self, node):
+        from homie.node.property.property_integer import Property_Integer
         data_format = "%s:%s" % (
             self.min_value, self.max_value) if self.min_value is not None and self.max_value is not None else None
         return Property_Integer(node,
@@ -50,16 +176,26 @@ class FloatProperty(Property):
                  meta: dict = {},
                  min_value: int = None,
                  max_value: int = None,
-                 initial_value = None):
-        super().__init__(id, meta, initial_value)
+                 initial_value = None,
+                 clamp: bool = False,
+                 precision: int = None,
+                 poll=None,
+                 interval: float = None,
+                 qos: int = 1):
+        super().__init__(id, meta, initial_value, poll, interval, qos)
         self.name = homie_name(id, name)
         self.set_handler = set_handler
         self.unit = unit
         self.retained = retained
         self.min_value = min_value
         self.max_value = max_value
+        self.clamp = clamp
+        self.precision = precision
+        self._validate = range_validator(float, min_value, max_value, clamp)
+        self._serialize = float_serializer(precision)
 
     def create_homie_property(self, node):
+        from homie.node.property.property_float import Property_Float
         data_format = "%s:%s" % (
             self.min_value, self.max_value) if self.min_value is not None and self.max_value is not None else None
         return Property_Float(node,
@@ -81,14 +217,20 @@ class BooleanProperty(Property):
                  unit: str = None,
                  retained: bool = True,
                  meta: dict = {},
-                 initial_value = None):
-        super().__init__(id, meta, initial_value)
+                 initial_value = None,
+                 poll=None,
+                 interval: float = None,
+                 qos: int = 1):
+        super().__init__(id, meta, initial_value, poll, interval, qos)
         self.name = homie_name(id, name)
         self.set_handler = set_handler
         self.unit = unit
         self.retained = retained
+        self._validate = boolean_validator
+        self._serialize = boolean_serializer
 
     def create_homie_property(self, node):
+        from homie.node.property.property_boolean import Property_Boolean
         return Property_Boolean(node,
                                 id=self.id,
                                 name=self.name,
@@ -108,15 +250,20 @@ class EnumProperty(Property):
                  retained: bool = True,
                  meta: dict = {},
                  values: list = [],
-                 initial_value = None):
-        super().__init__(id, meta, initial_value)
+                 initial_value = None,
+                 poll=None,
+                 interval: float = None,
+                 qos: int = 1):
+        super().__init__(id, meta, initial_value, poll, interval, qos)
         self.name = homie_name(id, name)
         self.set_handler = set_handler
         self.unit = unit
         self.retained = retained
         self.values = values
+        self._validate = enum_validator(values)
 
     def create_homie_property(self, node):
+        from homie.node.property.property_enum import Property_Enum
         return Property_Enum(node,
                              id=self.id,
                              name=self.name,
@@ -137,8 +284,11 @@ class StringProperty(Property):
                  retained: bool = True,
                  meta: dict = {},
                  data_format: str = None,
-                 initial_value = None):
-        super().__init__(id, meta, initial_value)
+                 initial_value = None,
+                 poll=None,
+                 interval: float = None,
+                 qos: int = 1):
+        super().__init__(id, meta, initial_value, poll, interval, qos)
         self.name = homie_name(id, name)
         self.set_handler = set_handler
         self.unit = unit
@@ -146,6 +296,7 @@ class StringProperty(Property):
         self.data_format = data_format
 
     def create_homie_property(self, node):
+        from homie.node.property.property_string import Property_String
         return Property_String(node,
                                id=self.id,
                                name=self.name,
@@ -155,3 +306,43 @@ class StringProperty(Property):
                                retained=self.retained,
                                meta=to_homie4_meta(self.meta),
                                data_format=self.data_format)
+
+
+class ArrayProperty(Property):
+    def __init__(self,
+                 id: str,
+                 name: str = None,
+                 set_handler=None,
+                 unit: str = None,
+                 retained: bool = True,
+                 meta: dict = {},
+                 encoding: str = 'json',
+                 dtype: str = 'float64',
+                 initial_value = None,
+                 poll=None,
+                 interval: float = None,
+                 qos: int = 1):
+        super().__init__(id, meta, initial_value, poll, interval, qos)
+        self.name = homie_name(id, name)
+        self.set_handler = set_handler
+        self.unit = unit
+        self.retained = retained
+        self.encoding = encoding
+        self.dtype = dtype
+        self.data_format = array_format(encoding, dtype)
+        self._validate = array_validator(dtype)
+        self._serialize = array_encoder(encoding, dtype)
+
+    def create_homie_property(self, node):
+        from homie.node.property.property_string import Property_String
+        homie4_property = Property_String(node,
+                                          id=self.id,
+                                          name=self.name,
+                                          settable=self.set_handler is not None,
+                                          unit=self.unit,
+                                          set_value=self.set_handler,
+                                          retained=self.retained,
+                                          meta=to_homie4_meta(self.meta),
+                                          data_format=self.data_format)
+        homie4_property.get_value_from_payload = array_decoder(self.encoding, self.dtype)
+        return homie4_property
@@ -0,0 +1,192 @@
+import heapq
+import logging
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PollSource:
+    def __init__(self, device, property):
+        self.device = device
+        self.property = property
+        self.interval = property.interval
+        self.failures = 0
+        self.running = False
+        self.completed = 0
+        self.removed = False
+
+    def delay(self, max_backoff: float) -> float:
+        if self.failures == 0:
+            return self.interval
+        return min(self.interval * 2 ** self.failures, max(max_backoff, self.interval))
+
+
+class PollBatch:
+    # results of the polls started in one tick, published together when all are in or when the timeout passes
+    def __init__(self, sources: list, deadline: float):
+        self.pending = set(sources)
+        # (source, number of its completed polls, message)
+        self.results = []
+        self.deadline = deadline
+        self.closed = False
+
+
+class PollingScheduler:
+    # one timer wheel and one worker pool for the polled properties of any number of devices
+    def __init__(self, workers: int = 4, resolution: float = 0.1, jitter: float = 0.05, timeout: float = 1.0,
+                 max_backoff: float = 300.0):
+        self.logger = logging.getLogger('PollingScheduler')
+        self.sources = []
+        self.resolution = resolution
+        self.jitter = jitter
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='homie-poll')
+        # timer wheel: absolute slot number -> sources due in that slot; the heap orders the slots
+        self._slots = {}
+        self._slot_heap = []
+        self._batches = []
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def add(self, device, properties: list) -> list:
+        # the wheel thread is started with the first sources, so that an unused scheduler costs nothing
+        now = time.monotonic()
+        sources = [PollSource(device, property) for property in properties]
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("PollingScheduler is stopped")
+            self.sources.extend(sources)
+            for source in sources:
+                # jitter spreads the first polls of the sources; later ones keep their phase, see _tick
+                self._schedule(source, now + random.uniform(0, self.jitter))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='homie-poll-scheduler', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return sources
+
+    def remove(self, device):
+        # sources of the device are dropped from the wheel when next due; polls in progress are not published
+        with self._condition:
+            for source in self.sources:
+                if source.device is device:
+                    source.removed = True
+            self.sources = [source for source in self.sources if not source.removed]
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._executor.shutdown(wait=False)
+
+    def _schedule(self, source: PollSource, due: float):
+        # the epsilon keeps a due time falling on a slot boundary in that slot despite rounding errors
+        slot = math.ceil(due / self.resolution - 1e-6)
+        if slot not in self._slots:
+            self._slots[slot] = []
+            heapq.heappush(self._slot_heap, slot)
+        self._slots[slot].append(source)
+
+    def _run(self):
+        # the wheel thread only starts polls and closes overdue batches - it never waits for a poll to finish
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    now = time.monotonic()
+                    deadlines = [batch.deadline for batch in self._batches]
+                    if self._slot_heap:
+                        deadlines.append(self._slot_heap[0] * self.resolution)
+                    if deadlines and min(deadlines) <= now:
+                        break
+                    self._condition.wait(min(deadlines) - now if deadlines else None)
+                if self._stopped:
+                    return
+                for batch in [batch for batch in self._batches if batch.deadline <= now]:
+                    for source in batch.pending:
+                        source.failures += 1
+                        self.logger.warning("Polling property %s takes longer than %ss" % (source.property.id, self.timeout))
+                    self._close(batch)
+                slot = None
+                if self._slot_heap and self._slot_heap[0] * self.resolution <= now:
+                    slot = heapq.heappop(self._slot_heap)
+                    due = self._slots.pop(slot)
+            if slot is not None:
+                self._tick(due, slot * self.resolution)
+
+    def _tick(self, due: list, slot_time: float):
+        due = [source for source in due if not source.removed]
+        started = []
+        for source in due:
+            if source.running:
+                # still busy with the previous poll - treat it as slow and back off
+                source.failures += 1
+            else:
+                source.running = True
+                started.append(source)
+        batch = PollBatch(started, time.monotonic() + self.timeout)
+        with self._condition:
+            for source in due:
+                # counted from the slot rather than from now, so that intervals do not drift by the wheel's latency
+                self._schedule(source, slot_time + source.delay(self.max_backoff))
+            if len(started) > 0:
+                self._batches.append(batch)
+        for source in started:
+            try:
+                future = self._executor.submit(source.property.poll)
+            except RuntimeError:
+                # the executor was shut down by stop()
+                return
+            future.add_done_callback(lambda future, source=source: self._complete(batch, source, future))
+
+    def _complete(self, batch: PollBatch, source: PollSource, future):
+        # runs on a worker thread once a poll has finished
+        source.running = False
+        payload = self._accept(source, future)
+        with self._condition:
+            if payload is None or source.removed:
+                pass
+            elif batch.closed:
+                # too late for its batch, published on its own
+                source.completed += 1
+                source.property._publish(payload[0])
+            else:
+                source.failures = 0
+                source.completed += 1
+                homie4_property = source.property.raw_property()
+                if homie4_property.node.published:
+                    message = (homie4_property.topic, payload[0], True, source.property.qos)
+                    batch.results.append((source, source.completed, message))
+            batch.pending.discard(source)
+            if not batch.closed and len(batch.pending) == 0:
+                self._close(batch)
+
+    def _close(self, batch: PollBatch):
+        # called with the condition held, so that batches are published in the order they are closed;
+        # publish_batch only queues the messages; results superseded by a newer poll of the same source are dropped
+        batch.closed = True
+        self._batches.remove(batch)
+        messages = {}
+        for source, completed, message in batch.results:
+            if completed == source.completed and not source.removed:
+                messages.setdefault(source.device, []).append(message)
+        for device, device_messages in messages.items():
+            device.publish_batch(device_messages)
+
+    def _accept(self, source: PollSource, future):
+        # returns a one-element tuple with the payload, or None when there is nothing to publish
+        try:
+            value = future.result()
+            if value is None:
+                return None
+            return source.property._accept(value),
+        except Exception as e:
+            source.failures += 1
+            self.logger.warning("Polling property %s failed (%s in a row): %s" % (source.property.id, source.failures, e))
+            return None
+
+
+POLLING_SCHEDULER = PollingScheduler()
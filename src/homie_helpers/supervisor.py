@@ -0,0 +1,142 @@
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from .connections import CONNECTION_POOL
+from .device import State
+
+
+def run_worker(index: int, settings, factories: list, reports, stop, report_interval: float):
+    # stop is the receiving end of a pipe, readable (end of file) once the supervisor stops
+    # runs in a child process; every worker has its own connection pool, so its own MQTT connections
+    logger = logging.getLogger('SupervisorWorker')
+    devices = []
+    try:
+        for factory in factories:
+            devices.append(factory(settings))
+        while True:
+            reports.put((index, os.getpid(),
+                         {homie.id: homie.state.name for homie in devices},
+                         {'devices': len(devices), 'published': sum(homie.published_messages for homie in devices)}))
+            if stop.poll(report_interval):
+                break
+    except Exception:
+        logger.exception("Worker %s failed" % index)
+        raise
+    finally:
+        for homie in devices:
+            homie.stop_polling()
+            homie.state = State.DISCONNECTED
+        CONNECTION_POOL.close()
+
+
+class Supervisor:
+    def __init__(self, settings, factories: list, processes: int = None, report_interval: float = 1.0,
+                 restart: bool = True, restart_delay: float = 1.0, max_restart_delay: float = 60.0,
+                 max_restarts: int = None):
+        self.logger = logging.getLogger('Supervisor')
+        self.settings = settings
+        self.processes = min(processes or os.cpu_count() or 1, max(len(factories), 1))
+        # factories are picklable callables (e.g. module-level functions) creating one Homie from MqttSettings
+        self.shards = [factories[index::self.processes] for index in range(self.processes)]
+        self.report_interval = report_interval
+        self.restart = restart
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.max_restarts = max_restarts
+        self.states = {}
+        self.metrics = {}
+        self._context = multiprocessing.get_context('spawn')
+        self._reports = self._context.Queue()
+        # a worker killed while waiting on a shared multiprocessing.Event would leave its lock held,
+        # so each worker gets a pipe which the supervisor closes to stop it
+        self._stop = threading.Event()
+        self._stop_pipes = [None] * self.processes
+        self._workers = [None] * self.processes
+        # restarts in a row (reset by a report of the worker) and when the next one is due, per worker
+        self._restarts = [0] * self.processes
+        self._restart_at = [None] * self.processes
+        self._devices_by_worker = {}
+        self._lock = threading.Lock()
+        self._monitor = threading.Thread(target=self._collect, name='homie-supervisor', daemon=True)
+
+    def start(self):
+        for index in range(self.processes):
+            self._start_worker(index)
+        self._monitor.start()
+
+    def _start_worker(self, index: int):
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=run_worker, name='homie-worker-%s' % index, daemon=True,
+                                        args=(index, self.settings, self.shards[index], self._reports, receiver,
+                                              self.report_interval))
+        process.start()
+        receiver.close()
+        if self._stop_pipes[index] is not None:
+            self._stop_pipes[index].close()
+        self._stop_pipes[index] = sender
+        self._workers[index] = process
+
+    def _collect(self):
+        while not self._stop.is_set():
+            try:
+                index, pid, states, metrics = self._reports.get(timeout=self.report_interval)
+                # reports of a worker which has died since are stale
+                if pid == self._workers[index].pid:
+                    self._restarts[index] = 0
+                    with self._lock:
+                        self._devices_by_worker[index] = list(states)
+                        self.states.update({id: State[state] for id, state in states.items()})
+                        self.metrics[index] = dict(metrics, pid=pid, reported_at=time.time())
+            except queue.Empty:
+                pass
+            self._check_workers()
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for index, process in enumerate(self._workers):
+            if process.is_alive() or self._stop.is_set():
+                continue
+            if self._restart_at[index] is None:
+                self.logger.warning("Worker %s exited with code %s" % (index, process.exitcode))
+                with self._lock:
+                    for id in self._devices_by_worker.get(index, []):
+                        self.states[id] = State.LOST
+                    self.metrics.pop(index, None)
+                if not self.restart or (self.max_restarts is not None and self._restarts[index] >= self.max_restarts):
+                    self.logger.error("Worker %s is not restarted" % index)
+                    self._restart_at[index] = math.inf
+                    continue
+                # exponential backoff, so that e.g. an unreachable broker does not turn into a spawn loop
+                delay = min(self.restart_delay * 2 ** self._restarts[index], self.max_restart_delay)
+                self._restart_at[index] = now + delay
+            if now >= self._restart_at[index]:
+                self._restarts[index] += 1
+                self._restart_at[index] = None
+                self._start_worker(index)
+
+    def totals(self) -> dict:
+        with self._lock:
+            return {
+                'processes': self.processes,
+                'devices': sum(metrics['devices'] for metrics in self.metrics.values()),
+                'published': sum(metrics['published'] for metrics in self.metrics.values()),
+            }
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        for sender in self._stop_pipes:
+            if sender is not None:
+                sender.close()
+        deadline = time.monotonic() + timeout
+        for process in self._workers:
+            if process is not None:
+                process.join(max(deadline - time.monotonic(), 0))
+                if process.is_alive():
+                    process.terminate()
+        if self._monitor.is_alive():
+            self._monitor.join()
@@ -0,0 +1,322 @@
+import time
+
+import paho.mqtt.client as mqtt
+import pytest
+
+from .connections import ConnectionPool
+from .device import MqttSettings, MqttClient, Homie, Node
+from .local_broker import LocalBroker, PROPERTY_MESSAGE_EXPIRY
+from .properties import IntProperty
+
+# nothing listens there, so connections are refused immediately and paho keeps retrying in the background
+UNAVAILABLE = '127.0.0.1'
+UNAVAILABLE_PORT = 1
+
+
+class TestConnectionPool:
+
+    def setup_method(self, method):
+        self.pool = ConnectionPool()
+
+    def teardown_method(self, method):
+        self.pool.close()
+
+    def test_should_share_connection_for_same_broker(self):
+        # given
+        settings = MqttSettings(UNAVAILABLE, port=UNAVAILABLE_PORT)
+
+        # when
+        first = self.pool.acquire(settings, shard_key='device-1')
+        second = self.pool.acquire(MqttSettings(UNAVAILABLE, port=UNAVAILABLE_PORT))
+
+        # then
+        assert first is second
+        assert len(self.pool) == 1
+
+    @pytest.mark.parametrize("other", [
+        MqttSettings(UNAVAILABLE, port=UNAVAILABLE_PORT, username='someone'),
+        MqttSettings(UNAVAILABLE, port=UNAVAILABLE_PORT, topic='other'),
+        MqttSettings('localhost', port=UNAVAILABLE_PORT),
+    ])
+    def test_should_not_share_connection_for_different_settings(self, other):
+        # when
+        first = self.pool.acquire(MqttSettings(UNAVAILABLE, port=UNAVAILABLE_PORT))
+        second = self.pool.acquire(other)
+
+        # then
+        assert first is not second
+        assert len(self.pool) == 2
+
+    def test_should_not_share_device_connection_without_last_will(self):
+        # given
+        settings = MqttSettings(UNAVAILABLE, port=UNAVAILABLE_PORT)
+
+        # when
+        listener = self.pool.acquire(settings)
+        first = self.pool.acquire(settings, shard_key='device-1', last_will='homie/device-1/$state')
+        second = self.pool.acquire(settings, shard_key='device-2', last_will='homie/device-2/$state')
+
+        # then
+        assert first is not listener
+        assert first is second
+        assert first.last_will == 'homie/device-1/$state'
+
+    def test_should_shard_devices_across_connections(self):
+        # given
+        settings = MqttSettings(UNAVAILABLE, port=UNAVAILABLE_PORT, shards=4)
+
+        # when
+        clients = [self.pool.acquire(settings, shard_key='device-%s' % i) for i in range(32)]
+
+        # then
+        assert len(self.pool) == 4
+        assert self.pool.acquire(settings, shard_key='device-7') is clients[7]
+
+    def test_should_fail_over_to_next_broker(self):
+        # given
+        settings = MqttSettings(UNAVAILABLE, port=UNAVAILABLE_PORT, failover=['127.0.0.1:2', 'localhost'])
+
+        # when
+        client = self.pool.acquire(settings)
+
+        # then
+        assert settings.brokers() == [(UNAVAILABLE, 1), ('127.0.0.1', 2), ('localhost', 1)]
+        assert client.broker_index == 0  # all brokers refused, cycled back to the first one
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+class TestLocalBrokerConnections:
+
+    def setup_method(self, method):
+        self.broker = LocalBroker()
+        self.pools = [ConnectionPool()]
+
+    def teardown_method(self, method):
+        for pool in self.pools:
+            pool.close()
+        self.broker.close()
+
+    def settings(self, **kwargs):
+        return MqttSettings('127.0.0.1', port=self.broker.port, topic='test-homie', **kwargs)
+
+    @pytest.mark.parametrize("mqtt5", [False, True])
+    def test_should_not_share_device_connection_with_listener(self, mqtt5):
+        # given
+        pool = self.pools[0]
+        settings = self.settings(mqtt5=mqtt5)
+        listener = MqttClient(settings, pool=pool).listen('test-homie/test-device/status/prop', processor=int)
+        homie = Homie(settings, 'test-device', nodes=[Node("status", properties=[IntProperty("prop")])], pool=pool)
+
+        # when
+        homie['prop'] = 5
+
+        # then
+        assert wait_until(lambda: listener.value == 5)
+        assert len(pool) == 2
+        assert [session.will[0] for session in self.broker.sessions if session.will is not None] == [
+            'test-homie/test-device/$state']
+
+    def test_should_shrink_repeated_topics_with_aliases(self):
+        # given
+        received_bytes = {}
+        for mqtt5 in [False, True]:
+            connection = self.pools[0].acquire(self.settings(mqtt5=mqtt5))
+            assert wait_until(lambda: connection.mqtt_connected)
+            start = len(self.broker.received)
+            bytes_before = self.broker.received_bytes
+
+            # when
+            for i in range(20):
+                connection.publish('test-homie/a-rather-long-device-id/a-node/a-property', str(i), False, 0, alias=True)
+            assert wait_until(lambda: len(self.broker.received) == start + 20)
+            received_bytes[mqtt5] = self.broker.received_bytes - bytes_before
+
+        # then
+        assert [topic for topic, payload, qos, properties in self.broker.received[-20:]] == \
+               ['test-homie/a-rather-long-device-id/a-node/a-property'] * 20
+        assert received_bytes[True] < received_bytes[False] / 2
+
+    def test_should_publish_values_with_expiry(self):
+        # given
+        settings = self.settings(mqtt5=True, value_expiry_s=60)
+        homie = Homie(settings, 'test-device', nodes=[Node("status", properties=[IntProperty("prop")])],
+                      pool=self.pools[0])
+
+        # when
+        homie['prop'] = 5
+
+        # then
+        assert wait_until(lambda: any(topic == 'test-homie/test-device/status/prop'
+                                      for topic, payload, qos, properties in self.broker.received))
+        values = [properties for topic, payload, qos, properties in self.broker.received
+                  if topic == 'test-homie/test-device/status/prop']
+        names = [properties for topic, payload, qos, properties in self.broker.received
+                 if topic == 'test-homie/test-device/status/prop/$name']
+        assert values[0][PROPERTY_MESSAGE_EXPIRY] == 60
+        assert PROPERTY_MESSAGE_EXPIRY not in names[0]
+
+    def test_should_split_messages_between_shared_subscribers(self):
+        # given
+        self.pools.append(ConnectionPool())
+        settings = self.settings(mqtt5=True)
+        workers = [MqttClient(settings, pool=pool, share_group='workers') for pool in self.pools]
+        received = [[], []]
+        for worker, messages in zip(workers, received):
+            worker.listen('test-homie/device/node/prop', processor=messages.append)
+        assert wait_until(lambda: all(worker.connection.mqtt_connected for worker in workers))
+        time.sleep(0.2)
+        publisher = ConnectionPool()
+        self.pools.append(publisher)
+        connection = publisher.acquire(self.settings())
+        assert wait_until(lambda: connection.mqtt_connected)
+
+        # when
+        for i in range(10):
+            connection.publish('test-homie/device/node/prop', str(i), False, 0)
+
+        # then
+        assert wait_until(lambda: len(received[0]) + len(received[1]) == 10)
+        assert len(received[0]) == 5
+        assert len(received[1]) == 5
+
+    @pytest.mark.parametrize("mqtt5", [False, True])
+    @pytest.mark.parametrize("qos", [0, 1, 2])
+    def test_should_publish_value_with_property_qos(self, mqtt5, qos):
+        # given
+        homie = Homie(self.settings(mqtt5=mqtt5), 'test-device', pool=self.pools[0],
+                      nodes=[Node("status", properties=[IntProperty("prop", qos=qos)])])
+
+        # when
+        future = homie.set('prop', 5)
+
+        # then
+        assert future.wait(5)
+        assert future.succeeded()
+        assert future.latency >= 0
+        # QoS 0 completes once written to the socket, before the broker reads it
+        assert wait_until(lambda: [message_qos for topic, payload, message_qos, properties in self.broker.received
+                                   if topic == 'test-homie/test-device/status/prop'] == [qos])
+
+    def test_should_flush_pending_values(self):
+        # given
+        homie = Homie(self.settings(), 'test-device', pool=self.pools[0],
+                      nodes=[Node("status", properties=[IntProperty("prop")])])
+
+        # when
+        futures = [homie.set('prop', i) for i in range(100)]
+
+        # then
+        assert homie.flush(5)
+        assert all(future.succeeded() for future in futures)
+
+    def test_should_not_flush_values_without_acknowledgement(self):
+        # given
+        homie = Homie(self.settings(), 'test-device', pool=self.pools[0],
+                      nodes=[Node("status", properties=[IntProperty("prop")])])
+        assert homie.flush(5)
+        self.broker.close()
+        assert wait_until(lambda: not homie._device.mqtt_client.mqtt_connected)
+
+        # when
+        future = homie.set('prop', 1)
+
+        # then
+        assert not homie.flush(0.3)
+        assert not future.done()
+
+    def test_should_return_future_from_client_publish(self):
+        # given
+        client = MqttClient(self.settings(), pool=self.pools[0])
+        assert wait_until(lambda: client.connection.mqtt_connected)
+
+        # when
+        info = client.publish('test-homie/topic', 'payload', qos=1)
+
+        # then
+        assert info.wait_for_publish(5)
+        assert info.is_published()
+
+    def test_should_unpack_future_from_client_publish_like_message_info(self):
+        # given
+        client = MqttClient(self.settings(), pool=self.pools[0])
+        assert wait_until(lambda: client.connection.mqtt_connected)
+
+        # when
+        rc, mid = client.publish('test-homie/topic', 'payload', qos=1)
+        info = client.publish('test-homie/topic', 'payload', qos=1)
+
+        # then
+        assert rc == mqtt.MQTT_ERR_SUCCESS
+        assert isinstance(mid, int)
+        assert info[0] == mqtt.MQTT_ERR_SUCCESS
+        assert info[1] == info.mid != mid
+
+    def test_should_raise_on_wait_for_dropped_client_publish(self):
+        # given
+        client = MqttClient(self.settings(), pool=self.pools[0])
+        assert wait_until(lambda: client.connection.mqtt_connected)
+        self.broker.close()
+        assert wait_until(lambda: not client.connection.mqtt_connected)
+
+        # when
+        info = client.publish('test-homie/topic', 'payload', qos=0)
+
+        # then
+        assert info.rc == mqtt.MQTT_ERR_NO_CONN
+        assert info.done() and not info.succeeded()
+        with pytest.raises(RuntimeError):
+            info.wait_for_publish(1)
+
+    def test_should_keep_connection_alive_when_listener_fails(self):
+        # given
+        pool = self.pools[0]
+        client = MqttClient(self.settings(), pool=pool)
+        failing = client.listen('test-homie/other/status/prop', processor=int)
+        listener = client.listen('test-homie/test-device/status/prop', processor=int)
+        assert wait_until(lambda: client.connection.mqtt_connected)
+
+        # when
+        client.connection.publish('test-homie/other/status/prop', 'not a number', False, 0)
+        client.connection.publish('test-homie/other/status/prop', b'\xff\xfe', False, 0)
+        client.connection.publish('test-homie/test-device/status/prop', '5', False, 0)
+
+        # then
+        assert wait_until(lambda: listener.value == 5)
+        assert failing.value is None
+
+    def test_should_not_keep_acknowledgements_of_raw_client_publishes(self):
+        # given
+        client = MqttClient(self.settings(), pool=self.pools[0])
+        assert wait_until(lambda: client.connection.mqtt_connected)
+
+        # when
+        infos = [client.client.publish('test-homie/raw', str(i), qos=1) for i in range(20)]
+        assert wait_until(lambda: all(info.is_published() for info in infos))
+        future = client.publish('test-homie/tracked', 'payload', qos=1)
+
+        # then
+        assert future.wait(5)
+        assert len(client.connection._acknowledged) == 0
+        assert len(client.connection._in_flight) == 0
+
+    @pytest.mark.parametrize("code", [0x8B, 0x8E])
+    def test_should_reconnect_after_disconnect_with_reason_code(self, code):
+        # given
+        client = MqttClient(self.settings(mqtt5=True), pool=self.pools[0])
+        listener = client.listen('test-homie/test-device/status/prop', processor=int)
+        assert wait_until(lambda: client.connection.subscribed())
+
+        # when
+        self.broker.disconnect(code)
+
+        # then
+        assert wait_until(lambda: not client.connection.mqtt_connected)
+        assert wait_until(lambda: client.connection.subscribed(), timeout=10)
+        self.broker.publish('test-homie/test-device/status/prop', b'5', False)
+        assert wait_until(lambda: listener.value == 5)
@@ -0,0 +1,130 @@
+import pytest
+
+from . import groups
+from .groups import PropertyGroup
+from .properties import FloatProperty, IntProperty
+from .test_properties import setup_property
+
+
+@pytest.fixture(params=['numpy', 'sequential'])
+def vectorized(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(groups, 'load_numpy', lambda: None)
+    return request.param
+
+
+def create_group(count, deadband=0.0, precision=None):
+    properties = [FloatProperty("ch-%s" % i) for i in range(count)]
+    device = setup_property(*properties)
+    return device, PropertyGroup(device, properties, deadband=deadband, precision=precision)
+
+
+def payloads(batch):
+    return {topic.split('/')[-1]: payload for topic, payload, retain, qos in batch}
+
+
+class TestPropertyGroup:
+
+    def test_should_publish_all_values_initially(self, vectorized):
+        # given
+        device, group = create_group(3)
+
+        # when
+        published = group.update([1.0, 2.0, 3.0])
+
+        # then
+        assert published == 3
+        assert len(device.batches) == 1
+        assert payloads(device.batches[0]) == {'ch-0': '1.0', 'ch-1': '2.0', 'ch-2': '3.0'}
+
+    def test_should_publish_only_values_outside_deadband(self, vectorized):
+        # given
+        device, group = create_group(3, deadband=0.5)
+        group.update([1.0, 2.0, 3.0])
+
+        # when
+        published = group.update([1.2, 2.6, 3.0])
+
+        # then
+        assert published == 1
+        assert payloads(device.batches[1]) == {'ch-1': '2.6'}
+
+    def test_should_compare_rounded_values(self, vectorized):
+        # given
+        device, group = create_group(2, precision=1)
+        group.update([1.01, 2.0])
+
+        # when
+        published = group.update([1.04, 2.06])
+
+        # then
+        assert published == 1
+        assert payloads(device.batches[1]) == {'ch-1': '2.1'}
+
+    def test_should_skip_invalid_values(self, vectorized):
+        # given
+        properties = [IntProperty("a", min_value=0, max_value=10), IntProperty("b")]
+        device = setup_property(*properties)
+        group = PropertyGroup(device, properties)
+
+        # when
+        published = group.update([20, 5])
+
+        # then
+        assert published == 1
+        assert payloads(device.batches[0]) == {'b': '5'}
+
+    def test_should_skip_non_integral_values_of_int_properties(self, vectorized):
+        # given
+        properties = [IntProperty("a"), IntProperty("b", min_value=0)]
+        device = setup_property(*properties)
+        group = PropertyGroup(device, properties)
+
+        # when
+        published = group.update([9.99, -0.9])
+
+        # then
+        assert published == 0
+
+        # when
+        published = group.update([3, 0.0])
+
+        # then
+        assert payloads(device.batches[1]) == {'a': '3', 'b': '0'}
+
+    @pytest.mark.parametrize("missing", [None, float('nan'), float('inf')])
+    def test_should_skip_missing_and_non_finite_values(self, vectorized, missing):
+        # given
+        device, group = create_group(2, precision=1)
+        group.update([1.0, 2.0])
+
+        # when
+        first = group.update([missing, 2.0])
+        second = group.update([missing, 2.0])
+        third = group.update([1.0, 2.0])
+
+        # then
+        assert first == second == third == 0
+        assert all(payloads(batch) == {} for batch in device.batches[1:])
+
+    def test_should_publish_first_finite_value_after_missing_ones(self, vectorized):
+        # given
+        device, group = create_group(2)
+        group.update([None, 2.0])
+
+        # when
+        published = group.update([1.0, 2.0])
+
+        # then
+        assert published == 1
+        assert payloads(device.batches[1]) == {'ch-0': '1.0'}
+
+    def test_should_reject_values_of_wrong_length(self, vectorized):
+        # given
+        device, group = create_group(2)
+
+        # expect
+        with pytest.raises(ValueError):
+            group.update([1.0])
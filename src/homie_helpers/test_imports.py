@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import homie_helpers
+
+
+def imported_modules(statement):
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', statement + "\nimport sys; print(' '.join(sys.modules))"],
+                            env=dict(os.environ, PYTHONPATH=src), check=True, capture_output=True, text=True).stdout
+    return set(output.split())
+
+
+class TestImports:
+
+    def test_should_not_import_mqtt_for_ids(self):
+        # when
+        modules = imported_modules("from homie_helpers import create_homie_id")
+
+        # then
+        assert 'paho.mqtt.client' not in modules
+        assert 'homie.device_base' not in modules
+
+    def test_should_not_import_typed_properties_for_client(self):
+        # when
+        modules = imported_modules("from homie_helpers import MqttClient")
+
+        # then
+        assert 'homie.node.property.property_integer' not in modules
+        assert 'numpy' not in modules
+
+    @pytest.mark.parametrize("name", homie_helpers.__all__)
+    def test_should_export_public_names(self, name):
+        assert getattr(homie_helpers, name).__name__ == name
+
+    def test_should_reject_unknown_name(self):
+        with pytest.raises(AttributeError):
+            homie_helpers.NoSuchProperty
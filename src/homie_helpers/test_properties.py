@@ -0,0 +1,255 @@
+import pytest
+from homie.node.node_base import Node_Base
+
+from .properties import IntProperty, FloatProperty, StringProperty, BooleanProperty, EnumProperty, ArrayProperty, \
+    array_decoder
+
+
+class RecordingDevice:
+    def __init__(self):
+        self.topic = 'test-homie/test-device'
+        self.state = 'init'
+        self.messages = {}
+
+        self.batches = []
+
+    def publish(self, topic, payload, retain, qos):
+        self.messages[topic] = payload
+
+    def publish_value(self, topic, payload, retain, qos):
+        self.publish(topic, payload, retain, qos)
+
+    def publish_batch(self, messages):
+        self.batches.append(messages)
+        for topic, payload, retain, qos in messages:
+            self.publish(topic, payload, retain, qos)
+
+
+def setup_property(*properties):
+    device = RecordingDevice()
+    node = Node_Base(device, 'status', 'Status', 'status')
+    node.published = True
+    for property in properties:
+        property.setup_homie4_property(node)
+    return device
+
+
+TOPIC = 'test-homie/test-device/status/prop'
+
+
+class TestProperties:
+
+    @pytest.mark.parametrize("property,set,expected", [
+        (IntProperty("prop"), 5, "5"),
+        (IntProperty("prop"), 5.0, "5"),
+        (IntProperty("prop"), "5", "5"),
+        (FloatProperty("prop"), 6, "6.0"),
+        (FloatProperty("prop", precision=2), 6.4567, "6.46"),
+        (BooleanProperty("prop"), True, "true"),
+        (BooleanProperty("prop"), False, "false"),
+        (BooleanProperty("prop"), "false", "false"),
+        (StringProperty("prop"), "a", "a"),
+        (EnumProperty("prop", values=["a", "b"]), "b", "b"),
+    ])
+    def test_should_serialize_value(self, property, set, expected):
+        # given
+        device = setup_property(property)
+
+        # when
+        property.value = set
+
+        # then
+        assert device.messages[TOPIC] == expected
+
+    @pytest.mark.parametrize("type", [IntProperty, FloatProperty])
+    @pytest.mark.parametrize("min, max, set, expected", [
+        (0, 100, 150, "100"),
+        (0, 100, -5, "0"),
+        (0, None, -5, "0"),
+        (None, 100, 150, "100"),
+        (0, 100, 50, "50"),
+    ])
+    def test_should_clamp_numeric_value(self, type, min, max, set, expected):
+        # given
+        property = type("prop", min_value=min, max_value=max, clamp=True)
+        device = setup_property(property)
+
+        # when
+        property.value = set
+
+        # then
+        assert device.messages[TOPIC] is not None
+        assert float(device.messages[TOPIC]) == float(expected)
+
+    @pytest.mark.parametrize("type", [IntProperty, FloatProperty])
+    @pytest.mark.parametrize("min, max, set", [
+        (0, 100, 150),
+        (0, 100, -5),
+        (None, 100, 150),
+        (0, None, -5),
+        (None, None, "not-a-number"),
+    ])
+    def test_should_reject_invalid_numeric_value(self, type, min, max, set):
+        # given
+        property = type("prop", min_value=min, max_value=max)
+        device = setup_property(property)
+        property.value = 1
+
+        # when
+        property.value = set
+
+        # then
+        assert device.messages[TOPIC] == ("1" if type == IntProperty else "1.0")
+        assert property.value == 1
+
+    @pytest.mark.parametrize("clamp", [False, True])
+    @pytest.mark.parametrize("min, max", [(0, 10), (0, None), (None, 10)])
+    def test_should_reject_nan_in_range(self, clamp, min, max):
+        # given
+        property = FloatProperty("prop", min_value=min, max_value=max, clamp=clamp)
+        device = setup_property(property)
+        property.value = 1
+
+        # when
+        property.value = float('nan')
+
+        # then
+        assert device.messages[TOPIC] == "1.0"
+
+    @pytest.mark.parametrize("set", ["False", "yes", "", 0, 1])
+    def test_should_reject_non_boolean_value(self, set):
+        # given
+        property = BooleanProperty("prop")
+        device = setup_property(property)
+        property.value = True
+
+        # when
+        property.value = set
+
+        # then
+        assert device.messages[TOPIC] == "true"
+
+    @pytest.mark.parametrize("min, max, set", [
+        (None, None, 9.99),
+        (0, 10, 9.99),
+        (0, None, -0.9),
+        (None, None, float('nan')),
+        (None, None, float('inf')),
+    ])
+    def test_should_reject_non_integral_value(self, min, max, set):
+        # given
+        property = IntProperty("prop", min_value=min, max_value=max, clamp=True)
+        device = setup_property(property)
+        property.value = 1
+
+        # when
+        property.value = set
+
+        # then
+        assert device.messages[TOPIC] == "1"
+
+    def test_should_reject_unknown_enum_value(self):
+        # given
+        property = EnumProperty("prop", values=["a", "b"])
+        device = setup_property(property)
+
+        # when
+        property.value = "c"
+
+        # then
+        assert TOPIC not in device.messages
+        assert property.value is None
+
+    @pytest.mark.parametrize("type", [IntProperty, FloatProperty, BooleanProperty, StringProperty])
+    def test_should_clear_value(self, type):
+        # given
+        property = type("prop")
+        device = setup_property(property)
+
+        # when
+        property.value = None
+
+        # then
+        assert device.messages[TOPIC] is None
+
+    @pytest.mark.parametrize("encoding", ['json', 'packed', 'zlib'])
+    @pytest.mark.parametrize("dtype,set", [
+        ('float64', [1.5, -2.25, 3.0]),
+        ('float32', [1.5, -2.25, 3.0]),
+        ('int16', [1, -2, 300]),
+        ('int32', [1, -2, 70000]),
+    ])
+    def test_should_publish_array_decodable_by_listener(self, encoding, dtype, set):
+        # given
+        property = ArrayProperty("prop", encoding=encoding, dtype=dtype)
+        device = setup_property(property)
+
+        # when
+        property.value = set
+
+        # then
+        assert isinstance(device.messages[TOPIC], str)
+        assert array_decoder(encoding, dtype)(device.messages[TOPIC]) == set
+
+    @pytest.mark.parametrize("encoding,expected", [
+        ('json', 'json'),
+        ('packed', 'packed:float32'),
+        ('zlib', 'zlib:float32'),
+    ])
+    def test_should_create_array_property_with_format(self, encoding, expected):
+        # when
+        property = ArrayProperty("prop", encoding=encoding, dtype='float32')
+        setup_property(property)
+
+        # then
+        assert property.raw_property().data_type == 'string'
+        assert property.raw_property().data_format == expected
+
+    def test_should_compress_large_array(self):
+        # given
+        property = ArrayProperty("prop", encoding='zlib', dtype='float32')
+        device = setup_property(property)
+
+        # when
+        property.value = [0.0] * 1000
+
+        # then
+        assert len(device.messages[TOPIC]) < 100
+
+    def test_should_decode_array_set_message(self):
+        # given
+        received = []
+        property = ArrayProperty("prop", encoding='json', dtype='int32', set_handler=received.append)
+        device = setup_property(property)
+
+        # when
+        property.raw_property().process_set_message(TOPIC + '/set', '[1,2,3]')
+
+        # then
+        assert received == [[1, 2, 3]]
+        assert device.messages[TOPIC] == '[1,2,3]'
+
+    @pytest.mark.parametrize("encoding,dtype", [('xml', 'float32'), ('json', 'complex')])
+    def test_should_not_create_array_property_with_unknown_format(self, encoding, dtype):
+        with pytest.raises(ValueError):
+            ArrayProperty("prop", encoding=encoding, dtype=dtype)
+
+    @pytest.mark.parametrize("qos", [-1, 3])
+    def test_should_not_create_property_with_invalid_qos(self, qos):
+        with pytest.raises(ValueError):
+            IntProperty("prop", qos=qos)
+
+    @pytest.mark.parametrize("encoding", ['packed', 'zlib'])
+    def test_should_reject_array_value_out_of_dtype_range(self, encoding):
+        # given
+        property = ArrayProperty("prop", encoding=encoding, dtype='int16')
+        device = setup_property(property)
+        property.value = [1]
+        published = device.messages[TOPIC]
+
+        # when
+        property.value = [100000]
+
+        # then
+        assert device.messages[TOPIC] == published
+        assert property.value == [1]
@@ -0,0 +1,176 @@
+import threading
+import time
+
+import pytest
+
+from .connections import ConnectionPool
+from .device import Homie, MqttClient, MqttSettings, Node
+from .local_broker import LocalBroker
+from .properties import FloatProperty, IntProperty
+from .scheduler import PollingScheduler, POLLING_SCHEDULER
+from .test_connections import wait_until
+from .test_properties import setup_property, TOPIC
+
+
+class TestPollingScheduler:
+
+    def setup_method(self, method):
+        self.scheduler = None
+
+    def teardown_method(self, method):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+
+    def start(self, properties, **kwargs):
+        device = setup_property(*properties)
+        self.scheduler = PollingScheduler(**kwargs)
+        self.scheduler.add(device, properties)
+        return device
+
+    def test_should_publish_results_of_one_tick_in_one_batch(self):
+        # given
+        properties = [IntProperty("prop-%s" % i, poll=lambda i=i: i, interval=60) for i in range(3)]
+
+        # when
+        device = self.start(properties, jitter=0.0)
+
+        # then
+        assert wait_until(lambda: len(device.batches) > 0)
+        assert sorted(payload for topic, payload, retain, qos in device.batches[0]) == ['0', '1', '2']
+
+    def test_should_poll_repeatedly(self):
+        # given
+        counter = iter(range(1000))
+        property = IntProperty("prop", poll=lambda: next(counter), interval=0.1)
+
+        # when
+        device = self.start([property])
+
+        # then
+        assert wait_until(lambda: len(device.batches) >= 3)
+        assert [batch[0][1] for batch in device.batches[:3]] == ['0', '1', '2']
+
+    def test_should_back_off_failing_source(self):
+        # given
+        def failing():
+            raise IOError("sensor not responding")
+        property = FloatProperty("prop", poll=failing, interval=0.1)
+
+        # when
+        self.start([property], max_backoff=10)
+        source = self.scheduler.sources[0]
+
+        # then
+        assert wait_until(lambda: source.failures >= 2)
+        assert source.delay(10) == pytest.approx(0.1 * 2 ** source.failures)
+
+    def test_should_publish_slow_source_on_its_own(self):
+        # given
+        release = threading.Event()
+
+        def slow():
+            release.wait()
+            return 42
+        fast = IntProperty("fast", poll=lambda: 1, interval=60)
+        property = IntProperty("slow", poll=slow, interval=60)
+        device = self.start([fast, property], jitter=0.0, timeout=0.1)
+        assert wait_until(lambda: len(device.batches) > 0)
+
+        # when
+        release.set()
+
+        # then
+        assert [payload for topic, payload, retain, qos in device.batches[0]] == ['1']
+        assert wait_until(lambda: device.messages.get('test-homie/test-device/status/slow') == '42')
+        assert self.scheduler.sources[1].failures == 1
+
+    def test_should_not_delay_fast_source_by_slow_one(self):
+        # given
+        counter = iter(range(1000))
+        fast = IntProperty("fast", poll=lambda: next(counter), interval=0.1)
+        slow = IntProperty("slow", poll=lambda: time.sleep(0.9) or 1, interval=1)
+
+        # when
+        device = self.start([fast, slow], timeout=1.0)
+        time.sleep(1.0)
+
+        # then
+        assert int(device.messages['test-homie/test-device/status/fast']) >= 7
+
+    def test_should_share_one_wheel_between_devices(self):
+        # given
+        first = IntProperty("prop", poll=lambda: 1, interval=60)
+        second = IntProperty("prop", poll=lambda: 2, interval=60)
+        first_device = self.start([first])
+        second_device = setup_property(second)
+        threads = threading.active_count()
+
+        # when
+        self.scheduler.add(second_device, [second])
+
+        # then
+        assert wait_until(lambda: TOPIC in first_device.messages and TOPIC in second_device.messages)
+        assert first_device.messages[TOPIC] == '1'
+        assert second_device.messages[TOPIC] == '2'
+        assert threading.active_count() <= threads + 1
+        assert len(self.scheduler.sources) == 2
+
+    def test_should_remove_sources_of_device(self):
+        # given
+        property = IntProperty("prop", poll=lambda: 1, interval=0.1)
+        device = self.start([property])
+        assert wait_until(lambda: len(device.batches) > 0)
+
+        # when
+        self.scheduler.remove(device)
+        time.sleep(0.2)
+        count = len(device.batches)
+        time.sleep(0.3)
+
+        # then
+        assert len(device.batches) == count
+        assert self.scheduler.sources == []
+
+    def test_should_require_interval_for_polled_property(self):
+        with pytest.raises(ValueError):
+            IntProperty("prop", poll=lambda: 1)
+
+    def test_should_stop_polling(self):
+        # given
+        property = IntProperty("prop", poll=lambda: 1, interval=0.1)
+        device = self.start([property])
+        assert wait_until(lambda: len(device.batches) > 0)
+
+        # when
+        self.scheduler.stop()
+        time.sleep(0.2)
+        count = len(device.batches)
+        time.sleep(0.3)
+
+        # then
+        assert len(device.batches) == count
+
+
+class TestHomiePolling:
+
+    def test_should_poll_device_properties(self):
+        # given
+        broker = LocalBroker()
+        pool = ConnectionPool()
+        settings = MqttSettings('127.0.0.1', port=broker.port, topic='test-homie')
+        listener = MqttClient(settings, pool=pool).listen('test-homie/test-device/status/prop', processor=float)
+
+        # when
+        homie = Homie(settings, 'test-device', pool=pool, nodes=[
+            Node("status", properties=[FloatProperty("prop", poll=lambda: 21.5, interval=60), IntProperty("other")])
+        ])
+
+        # then
+        try:
+            assert wait_until(lambda: listener.value == 21.5)
+            assert homie.scheduler is POLLING_SCHEDULER
+            assert len([source for source in homie.scheduler.sources if source.device is homie._device]) == 1
+        finally:
+            homie.stop_polling()
+            pool.close()
+            broker.close()
@@ -0,0 +1,106 @@
+import math
+import time
+from functools import partial
+
+from .device import Homie, MqttSettings, Node, State
+from .local_broker import LocalBroker
+from .properties import IntProperty
+from .supervisor import Supervisor
+from .test_connections import wait_until
+
+
+def create_device(id, settings):
+    homie = Homie(settings, id, nodes=[Node("status", properties=[IntProperty("prop")])])
+    homie['prop'] = 1
+    return homie
+
+
+def create_broken_device(settings):
+    raise RuntimeError("hardware not found")
+
+
+class TestSupervisor:
+
+    def setup_method(self, method):
+        self.broker = LocalBroker()
+        self.settings = MqttSettings('127.0.0.1', port=self.broker.port, topic='test-homie')
+        self.supervisor = None
+
+    def teardown_method(self, method):
+        if self.supervisor is not None:
+            self.supervisor.stop()
+        self.broker.close()
+
+    def test_should_run_devices_in_worker_processes(self):
+        # given
+        factories = [partial(create_device, 'device-%s' % i) for i in range(4)]
+        self.supervisor = Supervisor(self.settings, factories, processes=2, report_interval=0.2)
+
+        # when
+        self.supervisor.start()
+
+        # then
+        assert wait_until(lambda: len(self.supervisor.states) == 4, timeout=30)
+        assert wait_until(lambda: all(state == State.READY for state in self.supervisor.states.values()))
+        assert len({metrics['pid'] for metrics in self.supervisor.metrics.values()}) == 2
+        assert self.supervisor.totals()['devices'] == 4
+        assert wait_until(lambda: self.broker.retained.get('test-homie/device-3/status/prop', (None,))[0] == b'1')
+
+    def test_should_disconnect_devices_on_stop(self):
+        # given
+        self.supervisor = Supervisor(self.settings, [partial(create_device, 'device-1')], report_interval=0.2)
+        self.supervisor.start()
+        assert wait_until(lambda: len(self.supervisor.states) == 1, timeout=30)
+
+        # when
+        self.supervisor.stop()
+
+        # then
+        assert wait_until(lambda: self.broker.retained['test-homie/device-1/$state'][0] == b'disconnected')
+
+    def test_should_restart_failed_worker(self):
+        # given
+        self.supervisor = Supervisor(self.settings, [create_broken_device], report_interval=0.2, restart_delay=0.1)
+        self.supervisor.start()
+        first = self.supervisor._workers[0]
+
+        # then
+        assert wait_until(lambda: self.supervisor._workers[0] is not first, timeout=30)
+
+    def test_should_stop_restarting_after_max_restarts(self):
+        # given
+        self.supervisor = Supervisor(self.settings, [create_broken_device], report_interval=0.2, restart_delay=0.1,
+                                     max_restarts=1)
+
+        # when
+        self.supervisor.start()
+
+        # then
+        assert wait_until(lambda: self.supervisor._restart_at[0] == math.inf, timeout=30)
+        assert self.supervisor._restarts[0] == 1
+
+    def test_should_back_off_restarts(self):
+        # given
+        self.supervisor = Supervisor(self.settings, [create_broken_device], restart_delay=10)
+
+        # when
+        self.supervisor.start()
+
+        # then
+        assert wait_until(lambda: self.supervisor._restart_at[0] is not None, timeout=30)
+        assert self.supervisor._restart_at[0] - time.monotonic() > 5
+        assert self.supervisor._restarts[0] == 0
+
+    def test_should_forget_metrics_of_dead_worker(self):
+        # given
+        self.supervisor = Supervisor(self.settings, [partial(create_device, 'device-1')], report_interval=0.2,
+                                     restart=False)
+        self.supervisor.start()
+        assert wait_until(lambda: self.supervisor.totals()['devices'] == 1, timeout=30)
+
+        # when
+        self.supervisor._workers[0].terminate()
+
+        # then
+        assert wait_until(lambda: self.supervisor.totals()['devices'] == 0)
+        assert self.supervisor.states['device-1'] == State.LOST
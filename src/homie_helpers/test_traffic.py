@@ -0,0 +1,196 @@
+import time
+
+import pytest
+
+from .connections import ConnectionPool
+from .device import MqttClient, MqttSettings
+from .local_broker import LocalBroker
+from .test_connections import wait_until
+from .traffic import ArrivalCollector, TrafficRecorder, read_traffic, replay, replay_through_broker, main
+
+
+def write_capture(path, messages):
+    recorder = TrafficRecorder(str(path))
+    for topic, payload in messages:
+        recorder.collect(topic, payload)
+    recorder.close()
+    return str(path)
+
+
+class TestTraffic:
+
+    def test_should_record_messages_seen_by_client(self, tmp_path):
+        # given
+        broker = LocalBroker()
+        pool = ConnectionPool()
+        settings = MqttSettings('127.0.0.1', port=broker.port, topic='test-homie')
+        client = MqttClient(settings, pool=pool)
+        recorder = client.record(str(tmp_path / 'capture.bin'))
+        assert wait_until(lambda: client.connection.mqtt_connected)
+        time.sleep(0.1)
+
+        # when
+        client.publish('test-homie/device/node/prop', 'zażółć')
+        client.publish('other/topic', 'ignored')
+        client.publish('test-homie/device/node/prop', '2')
+        try:
+            assert wait_until(lambda: recorder.count == 2)
+        finally:
+            recorder.close()
+            pool.close()
+            broker.close()
+
+        # then
+        assert [(topic, payload) for timestamp, topic, payload in read_traffic(recorder.path)] == [
+            ('test-homie/device/node/prop', 'zażółć'),
+            ('test-homie/device/node/prop', '2'),
+        ]
+
+    def test_should_ignore_messages_after_closing(self, tmp_path):
+        # given
+        recorder = TrafficRecorder(str(tmp_path / 'capture.bin'))
+        recorder.collect('a', '1')
+        recorder.close()
+
+        # when
+        recorder.collect('a', '2')
+
+        # then
+        assert [payload for timestamp, topic, payload in read_traffic(recorder.path)] == ['1']
+
+    def test_should_stop_recording(self, tmp_path):
+        # given
+        pool = ConnectionPool()
+        client = MqttClient(MqttSettings('127.0.0.1', port=1, topic='test-homie'), pool=pool)
+        recorder = client.record(str(tmp_path / 'capture.bin'))
+        client.dispatch('test-homie/d/n/p', '1')
+
+        # when
+        client.stop_recording(recorder)
+        client.dispatch('test-homie/d/n/p', '2')
+        pool.close()
+
+        # then
+        assert recorder not in client.mqtt_collectors
+        assert recorder.count == 1
+
+    def test_should_append_to_existing_capture(self, tmp_path):
+        # given
+        path = write_capture(tmp_path / 'capture.bin', [('a', '1')])
+
+        # when
+        write_capture(path, [('b', '2')])
+
+        # then
+        assert [topic for timestamp, topic, payload in read_traffic(path)] == ['a', 'b']
+
+    def test_should_reject_unknown_file(self, tmp_path):
+        # given
+        path = tmp_path / 'capture.bin'
+        path.write_bytes(b'something else')
+
+        # expect
+        with pytest.raises(ValueError):
+            list(read_traffic(str(path)))
+
+    def test_should_replay_into_listeners(self, tmp_path):
+        # given
+        path = write_capture(tmp_path / 'capture.bin', [('test-homie/d/n/p', str(i)) for i in range(100)])
+        pool = ConnectionPool()
+        client = MqttClient(MqttSettings('127.0.0.1', port=1, topic='test-homie'), pool=pool)
+        received = []
+        client.listen('test-homie/d/n/p', processor=received.append)
+
+        # when
+        try:
+            report = replay(path, client.dispatch, speed=0)
+        finally:
+            pool.close()
+
+        # then
+        assert received == [str(i) for i in range(100)]
+        assert report.messages == 100
+        assert report.throughput > 0
+        assert report.latency(50) <= report.latency(99) <= report.latency(100)
+
+    @pytest.mark.parametrize("speed, minimum, maximum", [
+        (1.0, 0.2, 1.0),
+        (4.0, 0.05, 0.2),
+        (0, 0.0, 0.05),
+    ])
+    def test_should_replay_with_speed(self, tmp_path, speed, minimum, maximum):
+        # given
+        path = str(tmp_path / 'capture.bin')
+        recorder = TrafficRecorder(path)
+        recorder.collect('a', '1')
+        time.sleep(0.2)
+        recorder.collect('a', '2')
+        recorder.close()
+
+        # when
+        report = replay(path, lambda topic, payload: None, speed=speed)
+
+        # then
+        assert minimum <= report.duration < maximum
+
+    def test_should_replay_through_broker(self, tmp_path):
+        # given
+        path = write_capture(tmp_path / 'capture.bin', [('test-homie/d/n/p', str(i)) for i in range(200)])
+        broker = LocalBroker()
+
+        # when
+        try:
+            report = replay_through_broker(path, MqttSettings('127.0.0.1', port=broker.port, topic='test-homie'),
+                                           speed=0)
+        finally:
+            broker.close()
+
+        # then
+        assert report.messages == 200
+        assert report.latency(100) > 0
+
+    def test_should_ignore_retained_messages_when_replaying_through_broker(self, tmp_path):
+        # given
+        path = write_capture(tmp_path / 'capture.bin', [('test-homie/d/n/p', '1'), ('test-homie/d/n/p', '2')])
+        broker = LocalBroker()
+        broker.publish('test-homie/d/n/p', b'1', True)
+        broker.publish('test-homie/d/n/other', b'retained', True)
+
+        # when
+        try:
+            report = replay_through_broker(path, MqttSettings('127.0.0.1', port=broker.port, topic='test-homie'),
+                                           speed=0)
+        finally:
+            broker.close()
+
+        # then
+        assert report.messages == 2
+        assert report.latency(0) > 0
+
+    def test_should_match_arrivals_to_sent_messages(self):
+        # given
+        collector = ArrivalCollector(2)
+        collector.sent('a', '1')
+        collector.sent('a', '1')
+
+        # when
+        collector.collect('a', 'retained')
+        collector.collect('b', '1')
+        collector.collect('a', '1')
+        collector.collect('a', '1')
+        collector.collect('a', '1')
+
+        # then
+        assert collector.done.is_set()
+        assert len(collector.latencies) == 2
+        assert all(latency >= 0 for latency in collector.latencies)
+
+    def test_should_replay_from_command_line(self, tmp_path, capsys):
+        # given
+        path = write_capture(tmp_path / 'capture.bin', [('homie/d/n/p', str(i)) for i in range(10)])
+
+        # when
+        main([path, '--speed', '0'])
+
+        # then
+        assert 'messages=10;' in capsys.readouterr().out
@@ -0,0 +1,195 @@
+import argparse
+import collections
+import os
+import statistics
+import struct
+import threading
+import time
+
+from .connections import ConnectionPool
+from .device import MqttSettings, MqttClient
+from .local_broker import LocalBroker
+
+MAGIC = b'HHTRAF1\n'
+# timestamp (float64), topic length (uint16), payload length (uint32)
+RECORD_HEADER = struct.Struct('<dHI')
+
+
+class TrafficRecorder:
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def collect(self, topic, payload):
+        topic = topic.encode('utf-8')
+        payload = payload.encode('utf-8')
+        record = RECORD_HEADER.pack(time.time(), len(topic), len(payload)) + topic + payload
+        with self._lock:
+            # a recorder closed without stop_recording may still be called by the network thread
+            if self._file.closed:
+                return
+            self._file.write(record)
+            self.count += 1
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_traffic(path: str):
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a traffic capture" % path)
+        while True:
+            header = file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            timestamp, topic_length, payload_length = RECORD_HEADER.unpack(header)
+            topic = file.read(topic_length).decode('utf-8')
+            payload = file.read(payload_length).decode('utf-8')
+            yield timestamp, topic, payload
+
+
+class ReplayReport:
+    def __init__(self, messages: int, duration: float, latencies: list):
+        self.messages = messages
+        self.duration = duration
+        self.latencies = sorted(latencies)
+
+    @property
+    def throughput(self) -> float:
+        return self.messages / self.duration if self.duration > 0 else float('inf')
+
+    def latency(self, percentile: float) -> float:
+        if len(self.latencies) == 0:
+            return 0.0
+        return self.latencies[min(int(len(self.latencies) * percentile / 100), len(self.latencies) - 1)]
+
+    def __repr__(self):
+        mean = statistics.fmean(self.latencies) if self.latencies else 0.0
+        return "messages=%s; duration=%.3fs; throughput=%.0f msg/s; latency mean=%.1fus p50=%.1fus p99=%.1fus max=%.1fus" % (
+            self.messages, self.duration, self.throughput, mean * 1e6,
+            self.latency(50) * 1e6, self.latency(99) * 1e6, self.latency(100) * 1e6)
+
+
+def replay(path: str, dispatch, speed: float = 1.0) -> ReplayReport:
+    # speed: 1.0 replays in real time, N replays N times faster, 0 replays as fast as possible;
+    # latency is the time spent in dispatch, e.g. in MqttClient.dispatch and its listeners
+    latencies = []
+    first_timestamp = None
+    start = time.perf_counter()
+    for timestamp, topic, payload in read_traffic(path):
+        if speed > 0:
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            delay = (timestamp - first_timestamp) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        before = time.perf_counter()
+        dispatch(topic, payload)
+        latencies.append(time.perf_counter() - before)
+    return ReplayReport(len(latencies), time.perf_counter() - start, latencies)
+
+
+class ArrivalCollector:
+    # matches messages received by the listener to the replayed ones - per topic and payload, in the order they were
+    # sent - so that anything else (e.g. retained messages delivered on subscribe) is ignored
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.latencies = []
+        self.last_arrival = None
+        self.done = threading.Event()
+        self._sent = {}
+        self._lock = threading.Lock()
+        if expected == 0:
+            self.done.set()
+
+    def sent(self, topic, payload):
+        with self._lock:
+            self._sent.setdefault((topic, payload), collections.deque()).append(time.perf_counter())
+
+    def collect(self, topic, payload):
+        arrival = time.perf_counter()
+        with self._lock:
+            sent = self._sent.get((topic, payload))
+            if not sent:
+                return
+            self.latencies.append(arrival - sent.popleft())
+            self.last_arrival = arrival
+            if len(self.latencies) == self.expected:
+                self.done.set()
+
+    def report(self, start: float) -> ReplayReport:
+        with self._lock:
+            end = self.last_arrival or time.perf_counter()
+            return ReplayReport(len(self.latencies), end - start, self.latencies)
+
+
+def replay_through_broker(path: str, settings: MqttSettings, speed: float = 1.0, timeout: float = 10.0,
+                          pool: ConnectionPool = None) -> ReplayReport:
+    # publishes the capture to the broker and measures the latency until an MqttClient receives each message
+    listener_pool = ConnectionPool() if pool is None else pool
+    listener = MqttClient(settings, pool=listener_pool)
+    prefix = settings.topic + '/'
+    collector = ArrivalCollector(sum(1 for timestamp, topic, payload in read_traffic(path) if topic.startswith(prefix)))
+    listener.mqtt_collectors.append(collector)
+    publisher = ConnectionPool()
+    connection = publisher.acquire(settings)
+
+    def publish(topic, payload):
+        collector.sent(topic, payload)
+        connection.publish(topic, payload, False, 0)
+    try:
+        deadline = time.monotonic() + timeout
+        # the listener has to be subscribed (SUBACK received), or the first messages would be lost
+        while not (listener.connection.subscribed() and connection.mqtt_connected) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        start = time.perf_counter()
+        replay(path, publish, speed)
+        collector.done.wait(timeout)
+        return collector.report(start)
+    finally:
+        publisher.close()
+        if pool is None:
+            listener_pool.close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m homie_helpers.traffic',
+                                     description='Replays a traffic capture made with MqttClient.record()')
+    parser.add_argument('capture')
+    parser.add_argument('--speed', type=float, default=1.0, help='1 = real time, N = N times faster, 0 = no delays')
+    parser.add_argument('--broker', help='broker to replay to; a local broker stand-in is used by default')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--topic', default='homie')
+    parser.add_argument('--direct', action='store_true', help='skip the broker and call MqttClient.dispatch directly')
+    args = parser.parse_args(args)
+    if not os.path.exists(args.capture):
+        parser.error("No such file: %s" % args.capture)
+    broker = LocalBroker() if args.broker is None else None
+    settings = MqttSettings(args.broker or '127.0.0.1', port=broker.port if broker else args.port, topic=args.topic)
+    try:
+        if args.direct:
+            pool = ConnectionPool()
+            try:
+                report = replay(args.capture, MqttClient(settings, pool=pool).dispatch, args.speed)
+            finally:
+                pool.close()
+        else:
+            report = replay_through_broker(args.capture, settings, args.speed)
+        print(report)
+    finally:
+        if broker is not None:
+            broker.close()
+
+
+if __name__ == '__main__':
+    main()